@@ -0,0 +1,118 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""Render the dashboard headlessly at every refresh slot over a period.
+
+Useful to check a layout change or a new calendar across a whole week
+without waiting for the clock. The feeds are fetched and parsed once, in
+this process; the pool workers receive the parsed snapshots once each, load
+the fonts once each and then only draw. The panel driver is never touched.
+
+    python batch_render.py --days 7 --step 30 --output frames
+    python batch_render.py --upcoming team.ics --day team.ics --format packed
+"""
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import main
+from epd_compat import SimEPD
+from event_snapshot import SNAPSHOT_DAYS
+from frame_packer import pack_frame
+from ics_cache import fetch_ics, open_cached_ics
+
+# Set in each worker by _init_worker
+_worker = {}
+
+def load_feed(source, now):
+    """Snapshot of a feed as of now; source is an ICS file path or a URL."""
+    if os.path.exists(source):
+        with open(source, encoding='utf-8', errors='replace') as f:
+            return main.parse_feed(f, now, source)
+    if source.startswith("webcal://"):
+        source = source.replace("webcal://", "https://", 1)
+    if fetch_ics(main.http_session(), source) is None:
+        return None
+    feed = open_cached_ics(source)
+    if feed is None:
+        return None
+    with feed:
+        return main.parse_feed(feed, now, source)
+
+def _init_worker(upcoming, day):
+    _worker["upcoming"] = upcoming
+    _worker["day"] = day
+    _worker["fonts"] = main.load_fonts()
+    _worker["epd"] = SimEPD()
+
+def render_slot(now, output_dir, fmt):
+    """Draw the frame for now and write it; returns the file written."""
+    epd = _worker["epd"]
+    frame = main.draw_frame(epd, _worker["fonts"], lambda: _worker["upcoming"],
+                            lambda: _worker["day"], now=now)
+    path = output_dir / f"frame-{now:%Y%m%d-%H%M}"
+    if fmt == "png":
+        path = path.with_suffix(".png")
+        frame.canvas.convert("RGB").save(path)
+    else:
+        # The 4bpp payload exactly as display_payload would send it
+        path = path.with_suffix(".bin")
+        path.write_bytes(pack_frame(frame.canvas))
+    return path
+
+def slots(start, days, step_minutes):
+    now = start
+    while now < start + timedelta(days=days):
+        yield now
+        now += timedelta(minutes=step_minutes)
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="render dashboard frames for a period")
+    parser.add_argument('--start', help="first slot, ISO date or datetime in local time "
+                                        "(default: today at midnight)")
+    parser.add_argument('--days', type=float, default=7, help="length of the period")
+    parser.add_argument('--step', type=int, default=30, help="minutes between slots")
+    parser.add_argument('--upcoming', action='append',
+                        help="ICS file or URL for the upcoming list, repeatable "
+                             "(default: calendar1 from secrets.json)")
+    parser.add_argument('--day', help="ICS file or URL for the day column "
+                                      "(default: calendar2 from secrets.json)")
+    parser.add_argument('--format', choices=['png', 'packed'], default='png')
+    parser.add_argument('--output', default='batch_output', help="directory for the frames")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.start:
+        start = datetime.fromisoformat(args.start).replace(tzinfo=main.LOCAL_TZ)
+    else:
+        start = datetime.now(main.LOCAL_TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+    if args.days > SNAPSHOT_DAYS:
+        logging.warning("Snapshots only reach %d days ahead; later frames miss events",
+                        SNAPSHOT_DAYS)
+    upcoming_sources = args.upcoming or [main.load_secrets()["calendar1"]]
+    day_source = args.day or main.load_secrets()["calendar2"]
+    upcoming = [s for s in (load_feed(source, start) for source in upcoming_sources) if s]
+    day = load_feed(day_source, start)
+
+    output_dir = Path(args.output)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    # Render the static layers once here so the workers all find them cached
+    main.chrome_layers(SimEPD(), main.load_fonts())
+
+    # Quieten the per-frame logging of draw_frame in the workers
+    logging.getLogger().setLevel(logging.WARNING)
+    started = time.monotonic()
+    times = list(slots(start, args.days, args.step))
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=(upcoming, day)) as pool:
+        written = list(pool.map(render_slot, times, [output_dir] * len(times),
+                                [args.format] * len(times), chunksize=8))
+    logging.warning("Rendered %d frames to %s in %.1f s", len(written), output_dir,
+                    time.monotonic() - started)
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,342 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""Offline benchmark of the fetch -> parse -> render -> pack -> transmit pipeline.
+
+Needs no network or panel hardware: calendars come from generated fixture ICS
+files, every stage sees the same fixed "now", and the EPD driver talks to a
+recording backend in waveshare_epd.epdconfig (EPD_BACKEND=recorder). Results
+are written as JSON so runs can be compared across commits:
+
+    python benchmark.py --output before.json
+    python benchmark.py --sizes 10 1000 --baseline before.json
+
+--check instead verifies that the fast paths produce exactly the bytes of
+the simple ones, and exits non-zero if they do not:
+
+    python benchmark.py --check
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent
+FIXTURE_SIZES = [10, 100, 1000, 10000, 100000]
+# Share of fixture events that are recurring series
+RECURRING_SHARE = 0.1
+
+def fixture_ics(n_events, now):
+    """Build a calendar of n_events VEVENTs spread over two years around now,
+    RECURRING_SHARE of them daily or weekly series. Deterministic per size."""
+    rng = random.Random(n_events)
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//eink-cal//benchmark//EN"]
+    for i in range(n_events):
+        start = now + timedelta(minutes=15 * rng.randrange(-35040, 35040))
+        end = start + timedelta(minutes=15 * rng.randrange(1, 16))
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:bench-{n_events}-{i}",
+            "DTSTAMP:20240101T000000Z",
+            f"DTSTART:{start.astimezone(timezone.utc):%Y%m%dT%H%M%SZ}",
+            f"DTEND:{end.astimezone(timezone.utc):%Y%m%dT%H%M%SZ}",
+            f"SUMMARY:Benchmark event {i}",
+        ]
+        if rng.random() < RECURRING_SHARE:
+            freq = rng.choice(["DAILY", "WEEKLY"])
+            limit = rng.choice(["", ";COUNT=200", ";UNTIL=20300101T000000Z"])
+            lines.append(f"RRULE:FREQ={freq}{limit}")
+        lines.append("END:VEVENT")
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(lines) + "\r\n"
+
+class FakeSession:
+    """requests.Session stand-in that serves fixture bodies from memory."""
+
+    def __init__(self, bodies):
+        self.bodies = bodies
+
+    def get(self, url, headers=None, timeout=None, stream=False):
+        return FakeResponse(self.bodies[url].encode('utf-8'))
+
+class FakeResponse:
+    status_code = 200
+    headers = {}
+
+    def __init__(self, body):
+        self.body = body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+class Bench:
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = []
+
+    def time(self, stage, fn, events=None):
+        """Run fn repeat times and record min/median wall time; returns the
+        last result so stages can feed each other."""
+        durations = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            result = fn()
+            durations.append(time.perf_counter() - start)
+        self.results.append({
+            "stage": stage,
+            "events": events,
+            "min_s": min(durations),
+            "median_s": statistics.median(durations),
+        })
+        logging.warning("%-34s %7s events  %9.4f s", stage,
+                        events if events is not None else "-", min(durations))
+        return result
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _enter(workdir):
+    os.chdir(workdir)
+    sys.path.insert(0, str(REPO_DIR))
+    # Must be set before the driver first imports epdconfig
+    os.environ['EPD_BACKEND'] = 'recorder'
+
+def run(sizes, repeat, workdir):
+    _enter(workdir)
+    import main
+    from ical.calendar_stream import IcsCalendarStream
+    from epd_compat import SimEPD
+    from event_snapshot import build_snapshot, snapshot_horizon
+    from PIL import ImageDraw
+    from frame_packer import BLACK, new_canvas, pack_frame
+    from ics_cache import fetch_ics, open_cached_ics
+    from ics_stream import windowed_ics
+    from waveshare_epd import epd7in5bc, epdconfig
+
+    main.FONT_DIR = str(REPO_DIR / 'font')
+    fonts = main.load_fonts()
+    now = datetime(2026, 3, 4, 9, 30, tzinfo=main.LOCAL_TZ)
+    epd = epd7in5bc.EPD()
+    bench = Bench(repeat)
+
+    def render(snapshot):
+        canvas, overlay = main.static_layers(
+            "bench", (epd.width, epd.height),
+            lambda d, o: main.draw_static(d, o, fonts, epd.width, epd.height))
+        draw = ImageDraw.Draw(canvas)
+        main.process_upcoming_events([snapshot], draw, fonts[20], 7, now=now)
+        main.draw_day_blocks(snapshot, draw, fonts[18], epd.width, epd.height, now=now)
+        canvas.paste(BLACK, mask=overlay)
+        return canvas
+
+    for size in sizes:
+        url = f"bench://{size}"
+        session = FakeSession({url: fixture_ics(size, now)})
+        start, end = snapshot_horizon(now, main.LOCAL_TZ)
+
+        def parse():
+            with open_cached_ics(url) as feed:
+                ics = "\n".join(windowed_ics(feed, start.date(), end.date()))
+            return IcsCalendarStream.calendar_from_ics(ics)
+
+        bench.time("fetch_ics", lambda: fetch_ics(session, url), size)
+        calendar = bench.time("parse (windowed)", parse, size)
+        snapshot = bench.time("build_snapshot",
+                              lambda: build_snapshot(calendar, now, main.LOCAL_TZ), size)
+
+        def parse_cached():
+            with open_cached_ics(url) as feed:
+                return main.parse_feed(feed, now, url, main.series_file(url))
+
+        # Expands every series once, so the timed runs below reuse them all
+        parse_cached()
+        bench.time("parse_feed (series cached)", parse_cached, size)
+        image = new_canvas((epd.width, epd.height))
+
+        def upcoming(cold):
+            if cold:
+                main.event_store.cache_clear()
+            main.process_upcoming_events([snapshot], ImageDraw.Draw(image), fonts[20], 7, now=now)
+
+        def day_blocks(cold):
+            if cold:
+                main.event_store.cache_clear()
+                main.layout_lanes.cache_clear()
+            main.draw_day_blocks(snapshot, ImageDraw.Draw(image), fonts[18], epd.width, epd.height,
+                                 now=now)
+
+        # Cold runs rebuild the EventStore and lane layout a refresh after a
+        # feed change pays for; warm runs reuse them like an unchanged feed
+        bench.time("process_upcoming_events", lambda: upcoming(True), size)
+        bench.time("process_upcoming_events (cached)", lambda: upcoming(False), size)
+        bench.time("draw_day_blocks", lambda: day_blocks(True), size)
+        bench.time("draw_day_blocks (cached)", lambda: day_blocks(False), size)
+        canvas = render(snapshot)
+
+    # Packing and transmitting do not depend on the number of events
+    payload = bench.time("pack_frame", lambda: pack_frame(canvas))
+    recorder = epdconfig.implementation
+    recorder.reset_stats()
+    bench.time("EPD.display_payload", lambda: epd.display_payload(payload))
+    hardware_per_display = {name: value / repeat for name, value in recorder.stats().items()}
+    bench.time("SimEPD.display_payload", lambda: SimEPD().display_payload(payload))
+
+    # The two-layer API the driver keeps for other callers
+    black, red = two_layers(canvas)
+    black_buf = bench.time("EPD.getbuffer", lambda: epd.getbuffer(black))
+    red_buf = epd.getbuffer(red)
+    bench.time("EPD.display", lambda: epd.display(black_buf, red_buf))
+    bench.time("SimEPD.display", lambda: SimEPD().display(black, red))
+    return bench.results, hardware_per_display
+
+def two_layers(canvas):
+    """The black and red mode '1' layers of a frame canvas, as the driver's
+    two-layer API takes them."""
+    from frame_packer import BLACK, RED
+    return (canvas.point([0 if i == BLACK else 255 for i in range(256)], '1'),
+            canvas.point([0 if i == RED else 255 for i in range(256)], '1'))
+
+def reference_getbuffer(width, height, image):
+    """The driver's original per-pixel getbuffer, kept to check the fast one."""
+    buf = [0xFF] * (int(width/8) * height)
+    image_monocolor = image.convert('1')
+    imwidth, imheight = image_monocolor.size
+    pixels = image_monocolor.load()
+    if(imwidth == width and imheight == height):
+        for y in range(imheight):
+            for x in range(imwidth):
+                if pixels[x, y] == 0:
+                    buf[int((x + y * width) / 8)] &= ~(0x80 >> (x % 8))
+    elif(imwidth == height and imheight == width):
+        for y in range(imheight):
+            for x in range(imwidth):
+                newx = y
+                newy = height - x - 1
+                if pixels[x, y] == 0:
+                    buf[int((newx + newy*width) / 8)] &= ~(0x80 >> (y % 8))
+    return buf
+
+def check(workdir):
+    """Compare the fast paths against reference implementations; returns
+    the number of mismatches."""
+    _enter(workdir)
+    import main
+    from PIL import Image
+    from frame_packer import pack_frame
+    from waveshare_epd import epd7in5bc
+
+    main.FONT_DIR = str(REPO_DIR / 'font')
+    fonts = main.load_fonts()
+    now = datetime(2026, 3, 4, 9, 30, tzinfo=main.LOCAL_TZ)
+    epd = epd7in5bc.EPD()
+    snapshot = main.parse_feed(fixture_ics(1000, now).splitlines(), now, "fixture")
+    mismatches = 0
+
+    # The canvas payload must match the driver building one from the black
+    # and red layers, for frames with and without events
+    frames = ((0, True), (1, False), (5, True), (13, True))
+    for i, (hours, with_events) in enumerate(frames):
+        calendars = [snapshot] if with_events else []
+        frame = main.draw_frame(epd, fonts, lambda: calendars,
+                                lambda: calendars[0] if calendars else None,
+                                now=now + timedelta(hours=hours, minutes=7 * i))
+        black, red = two_layers(frame.canvas)
+        if pack_frame(frame.canvas) != epd.getpayload(epd.getbuffer(black),
+                                                      epd.getbuffer(red)):
+            logging.error("Mismatch: pack_frame differs from EPD.getpayload in frame %d", i)
+            mismatches += 1
+
+    # EPD.getbuffer must match the original per-pixel loop, in both
+    # orientations, for a drawn layer and for noise
+    layer = black
+    noise = Image.effect_noise((epd.width, epd.height), 64).convert('1')
+    for name, image in (("layer", layer), ("noise", noise)):
+        for orientation, rotated in (("horizontal", image),
+                                     ("vertical", image.transpose(Image.Transpose.ROTATE_270))):
+            if epd.getbuffer(rotated) != bytearray(
+                    reference_getbuffer(epd.width, epd.height, rotated)):
+                logging.error("Mismatch: EPD.getbuffer differs from the per-pixel loop "
+                              "(%s, %s)", name, orientation)
+                mismatches += 1
+    return mismatches
+
+def compare(results, baseline_file, threshold):
+    """Log stages that got slower than threshold x the baseline's min time;
+    returns the number of regressions."""
+    with open(baseline_file, encoding='utf-8') as f:
+        baseline = {(r["stage"], r["events"]): r["min_s"] for r in json.load(f)["results"]}
+    regressions = 0
+    for result in results:
+        before = baseline.get((result["stage"], result["events"]))
+        if before and result["min_s"] > before * threshold:
+            regressions += 1
+            logging.error("Regression: %s (%s events) %.4f s -> %.4f s", result["stage"],
+                          result["events"] or "-", before, result["min_s"])
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="offline pipeline benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+', default=FIXTURE_SIZES,
+                        help="fixture calendar sizes, in events")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per stage")
+    parser.add_argument('--output', help="write JSON results here instead of stdout")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="slowdown factor against the baseline counted as a regression")
+    parser.add_argument('--check', action='store_true',
+                        help="verify the fast paths against reference implementations "
+                             "instead of timing them")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="eink-bench-") as workdir:
+        try:
+            if args.check:
+                mismatches = check(workdir)
+            else:
+                results, hardware = run(args.sizes, args.repeat, workdir)
+        finally:
+            os.chdir(cwd)
+    if args.check:
+        logging.warning("%d mismatches", mismatches)
+        sys.exit(1 if mismatches else 0)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": args.repeat,
+        "hardware_per_display": hardware,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.baseline and compare(results, args.baseline, args.threshold):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
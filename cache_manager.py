@@ -0,0 +1,96 @@
+# -*- coding:utf-8 -*-
+"""Housekeeping for ./cache: atomic writes and a size/entry budget.
+
+Files are grouped into entries by the part of their name before the first
+dot, so a feed's <hash>.ics.gz, <hash>.json, <hash>.events.jsonl and
+<hash>.series.jsonl are kept or evicted together. An entry's last use is the
+newest access time of its files; readers call mark_used, which sets it
+explicitly so it does not depend on how the filesystem is mounted.
+"""
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+CACHE_DIR = Path('./cache')
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+MAX_CACHE_ENTRIES = 32
+# Entries never evicted
+PINNED_ENTRIES = ('last_frame',)
+# Temp files left behind by a crash are removed after this many seconds
+ORPHAN_AGE = 3600
+TEMP_SUFFIX = '.tmp'
+
+@contextmanager
+def atomic_open(path, mode='w', **kwargs):
+    """Open a temp file next to path and move it over path once the block
+    completes, so readers see either the old file or the whole new one."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name + '.', suffix=TEMP_SUFFIX)
+    try:
+        # mkstemp files are private; keep the permissions of a plain open()
+        os.chmod(tmp, 0o644)
+        with open(fd, mode, **kwargs) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def atomic_write(path, data):
+    """Write bytes or str to path atomically."""
+    if isinstance(data, bytes):
+        with atomic_open(path, 'wb') as f:
+            f.write(data)
+    else:
+        with atomic_open(path, 'w', encoding='utf-8') as f:
+            f.write(data)
+
+def mark_used(path):
+    """Record a read of path for LRU eviction, keeping its mtime."""
+    try:
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+    except OSError:
+        pass
+
+def _entries(cache_dir):
+    entries = {}
+    now = time.time()
+    for path in cache_dir.iterdir():
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        if path.name.endswith(TEMP_SUFFIX):
+            if now - stat.st_mtime > ORPHAN_AGE:
+                logging.info("Removing orphaned cache file %s", path.name)
+                path.unlink(missing_ok=True)
+            continue
+        entry = entries.setdefault(path.name.split('.', 1)[0], [0, 0, []])
+        entry[0] = max(entry[0], stat.st_atime, stat.st_mtime)
+        entry[1] += stat.st_size
+        entry[2].append(path)
+    return entries
+
+def enforce_budget(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, max_entries=MAX_CACHE_ENTRIES):
+    """Evict least recently used entries until the cache fits the budget."""
+    if not cache_dir.exists():
+        return
+    entries = _entries(cache_dir)
+    total = sum(size for _, size, _ in entries.values())
+    count = len(entries)
+    for name, (last_used, size, paths) in sorted(entries.items(), key=lambda e: e[1][0]):
+        if total <= max_bytes and count <= max_entries:
+            break
+        if name in PINNED_ENTRIES:
+            continue
+        logging.info("Evicting cache entry %s (%d bytes)", name, size)
+        for path in paths:
+            path.unlink(missing_ok=True)
+        total -= size
+        count -= 1
@@ -1,47 +1,118 @@
+import hashlib
+import json
+import logging
+import os
 import platform
+import time
+
+from PIL import Image
+
+from cache_manager import atomic_write
+from frame_packer import new_canvas
+
+# Simulation stub, used wherever the panel hardware is not available.
+
+class SimEPD:
+    width = 640
+    height = 384
+    busy_waits = ()
+    spi_seconds = 0.0
+    spi_bytes = 0
+    def __init__(self, packed=False):
+        # With packed=True, getbuffer returns the same 1-bpp bytes the
+        # real driver produces and display decodes them back.
+        self.packed = packed
+    def init(self):
+        logging.info("Simulated EPD init")
+    def Clear(self):
+        logging.info("Simulated EPD clear")
+    def getbuffer(self, image):
+        if not self.packed:
+            # In simulation, just return the image itself
+            return image
+        image = image.convert('1')
+        if image.size == (self.height, self.width):
+            image = image.transpose(Image.Transpose.ROTATE_90)
+        return bytearray(image.tobytes())
+    def _mask(self, layer):
+        # Mask of the "ink" (value 0) pixels of an image or packed buffer
+        if not isinstance(layer, Image.Image):
+            layer = Image.frombytes('1', (self.width, self.height), bytes(layer))
+        return layer.convert('L').point(lambda v: 255 if v == 0 else 0)
+    def composite(self, black, red):
+        # Combine black and red layers into a single image
+        combined = Image.new("RGB", (self.width, self.height), (255, 255, 255))
+        combined.paste((0, 0, 0), mask=self._mask(black))
+        combined.paste((160, 0, 0), mask=self._mask(red))
+        return combined
+    def display(self, black, red):
+        self._save(self.composite(black, red))
+    def display_payload(self, payload):
+        # Decode the 4bpp frame exactly as it would go over SPI
+        self._save(new_canvas((self.width, self.height), payload).convert("RGB"))
+    def _save(self, combined):
+        os.makedirs("sim_output", exist_ok=True)
+        combined.save("sim_output/combined.bmp", "BMP")
+        logging.info("Simulated display: combined.bmp written")
+    def sleep(self):
+        logging.info("Simulated EPD sleep")
+
+class SimEpd7in5bc:
+    EPD = SimEPD
 
 arch = platform.machine()
 
-if arch == "aarch64":
-    # Real hardware import
+if arch == "aarch64" or os.environ.get("EPD_BACKEND"):
+    # Real driver, on the panel or on a backend picked by EPD_BACKEND
     from waveshare_epd import epd7in5bc as real_epd7in5bc
     epd7in5bc = real_epd7in5bc
 else:
-    # Simulation stub
-    from PIL import Image
-    import os
-    import logging
-
-    class SimEPD:
-        width = 640
-        height = 384
-        def init(self):
-            logging.info("Simulated EPD init")
-        def Clear(self):
-            logging.info("Simulated EPD clear")
-        def getbuffer(self, image):
-            # In simulation, just return the image itself
-            return image
-        def display(self, black, red):
-            # Combine black and red layers into a single image
-            os.makedirs("sim_output", exist_ok=True)
-            combined = Image.new("RGB", (self.width, self.height), (255, 255, 255))
-            # Paste black layer
-            for y in range(self.height):
-                for x in range(self.width):
-                    if black.getpixel((x, y)) == 0:
-                        combined.putpixel((x, y), (0, 0, 0))
-            # Paste red layer
-            for y in range(self.height):
-                for x in range(self.width):
-                    if red.getpixel((x, y)) == 0:
-                        combined.putpixel((x, y), (160, 0, 0))
-            combined.save("sim_output/combined.bmp", "BMP")
-            logging.info("Simulated display: combined.bmp written")
-        def sleep(self):
-            logging.info("Simulated EPD sleep")
-
-    class SimEpd7in5bc:
-        EPD = SimEPD
-
     epd7in5bc = SimEpd7in5bc
+
+# Fingerprint of the last frame sent to the panel, so unchanged frames can
+# skip the 15-30 s tri-color refresh entirely.
+FRAME_STATE_FILE = "./cache/last_frame.json"
+
+def frame_fingerprint(payload, width, ignore=()):
+    """Hash the 4bpp panel payload, blanking the (x0, y0, x1, y1) boxes in
+    ignore, e.g. a clock that should not force a refresh."""
+    buf = bytearray(payload)
+    row_bytes = width // 2
+    for x0, y0, x1, y1 in ignore:
+        for y in range(max(y0, 0), min(y1, len(buf) // row_bytes)):
+            start = y * row_bytes + max(x0, 0) // 2
+            end = y * row_bytes + min((x1 + 1) // 2, row_bytes)
+            buf[start:end] = b"\x33" * (end - start)
+    return hashlib.sha1(buf).hexdigest()
+
+def load_frame_state(state_file=FRAME_STATE_FILE):
+    """Return the saved {"fingerprint", "refreshed_at"} state, or None."""
+    try:
+        with open(state_file, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def refresh_due(full_refresh_hours=24, state_file=FRAME_STATE_FILE):
+    """Return True if the panel needs a refresh whatever the next frame is:
+    there is no saved state, or the last full refresh is older than
+    full_refresh_hours, to keep ghosting in check."""
+    state = load_frame_state(state_file)
+    if state is None or "fingerprint" not in state:
+        return True
+    age_hours = (time.time() - state.get("refreshed_at", 0)) / 3600
+    if full_refresh_hours is not None and age_hours >= full_refresh_hours:
+        logging.info("Last full refresh was %.1f h ago", age_hours)
+        return True
+    return False
+
+def frame_changed(fingerprint, full_refresh_hours=24, state_file=FRAME_STATE_FILE):
+    """Return True if the panel needs a refresh for this frame: it differs
+    from the last one shown, or a refresh is due anyway (see refresh_due)."""
+    state = load_frame_state(state_file)
+    if state is None or state.get("fingerprint") != fingerprint:
+        return True
+    return refresh_due(full_refresh_hours, state_file)
+
+def save_frame_state(fingerprint, state_file=FRAME_STATE_FILE):
+    atomic_write(state_file, json.dumps({"fingerprint": fingerprint, "refreshed_at": time.time()}))
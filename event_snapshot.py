@@ -0,0 +1,173 @@
+# -*- coding:utf-8 -*-
+"""Compact on-disk snapshot of the events a calendar feed expands to.
+
+Rendering only needs each occurrence's start and end, whether it is all-day,
+its summary and its UID (plus recurrence-id, to recognise the same
+occurrence in several feeds). Instead of pickling the whole ical Calendar, the
+feed is expanded once over a horizon and stored as JSON lines: a header line
+with the format version and horizon, then one line per occurrence.
+"""
+import heapq
+import json
+import logging
+import sys
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import datetime, time, timedelta, timezone
+
+from cache_manager import atomic_open
+
+SNAPSHOT_VERSION = 2
+# Events longer than this (seconds) are checked one by one by
+# EventStore.overlapping, so a few multi-week events do not widen every query
+LONG_EVENT = 24 * 3600
+# Occurrences are expanded this many days past the day the snapshot is built
+SNAPSHOT_DAYS = 30
+# Rebuild from the raw feed once less than this much of the horizon is left
+MIN_LOOKAHEAD = timedelta(days=7)
+
+class Event(namedtuple('Event', 'start end all_day summary uid recurrence_id')):
+    """One occurrence; start and end are epoch seconds."""
+    __slots__ = ()
+
+    @property
+    def dtstart(self):
+        return datetime.fromtimestamp(self.start, timezone.utc)
+
+    @property
+    def dtend(self):
+        return datetime.fromtimestamp(self.end, timezone.utc)
+
+class Snapshot:
+    def __init__(self, events, horizon_start, horizon_end):
+        # Sorted by start, then end
+        self.events = events
+        self.horizon_start = horizon_start
+        self.horizon_end = horizon_end
+
+    def covers(self, now):
+        """True if the horizon still reaches far enough past now."""
+        ts = now.timestamp()
+        return self.horizon_start <= ts <= self.horizon_end - MIN_LOOKAHEAD.total_seconds()
+
+def _epoch(value, tz):
+    # All-day events carry plain dates; they start at local midnight
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, time(), tz)
+    return value.timestamp()
+
+def snapshot_horizon(now, tz):
+    """(start, end) of the horizon a snapshot built at now covers."""
+    start = datetime.combine(now.date() - timedelta(days=1), time(), tz)
+    return start, start + timedelta(days=SNAPSHOT_DAYS + 1)
+
+def expand_events(calendar, start, end, tz):
+    """The occurrences of an ical Calendar overlapping [start, end), in no
+    particular order."""
+    return [
+        Event(_epoch(event.dtstart, tz), _epoch(event.end, tz),
+              not isinstance(event.dtstart, datetime),
+              event.summary or "", event.uid or "",
+              str(event.recurrence_id) if event.recurrence_id else None)
+        for event in calendar.timeline_tz(tz).overlapping(start, end)
+    ]
+
+def build_snapshot(calendar, now, tz):
+    """Expand an ical Calendar over the horizon starting yesterday."""
+    start, end = snapshot_horizon(now, tz)
+    events = expand_events(calendar, start, end, tz)
+    events.sort(key=lambda e: (e.start, e.end))
+    return Snapshot(events, start.timestamp(), end.timestamp())
+
+def save_snapshot(snapshot, path):
+    with atomic_open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({
+            "version": SNAPSHOT_VERSION,
+            "horizon_start": snapshot.horizon_start,
+            "horizon_end": snapshot.horizon_end,
+        }) + "\n")
+        for event in snapshot.events:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+def load_snapshot(path):
+    """Load a snapshot, or return None if it is missing, corrupt or was
+    written by a different format version."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if header.get("version") != SNAPSHOT_VERSION:
+                logging.info("Ignoring event snapshot %s: format version %s",
+                             path, header.get("version"))
+                return None
+            events = [Event(*json.loads(line)) for line in f]
+    except (OSError, ValueError, TypeError) as e:
+        logging.error("Error loading event snapshot %s: %s", path, e)
+        return None
+    return Snapshot(events, header["horizon_start"], header["horizon_end"])
+
+def merged_events(snapshots):
+    """Lazily merge the sorted events of several snapshots into one ordered
+    stream, dropping occurrences already seen in another feed (same UID and
+    recurrence-id)."""
+    seen = set()
+    for event in heapq.merge(*(s.events for s in snapshots), key=lambda e: (e.start, e.end)):
+        if event.uid:
+            key = (event.uid, event.recurrence_id)
+            if key in seen:
+                continue
+            seen.add(key)
+        yield event
+
+class EventStore:
+    """Column-oriented, read-only table of events sorted by start.
+
+    Starts and ends are kept in parallel arrays of epoch seconds, so both
+    queries below bisect instead of scanning every event. Events longer than
+    LONG_EVENT are also listed apart, so they do not widen the bisect window. Summaries and UIDs
+    are interned, as recurring events repeat the same strings many times.
+    """
+
+    def __init__(self, events):
+        self.starts = array('d')
+        self.ends = array('d')
+        self.all_day = []
+        self.summaries = []
+        self.uids = []
+        self.recurrence_ids = []
+        for event in events:
+            self.starts.append(event.start)
+            self.ends.append(event.end)
+            self.all_day.append(event.all_day)
+            self.summaries.append(sys.intern(event.summary))
+            self.uids.append(sys.intern(event.uid))
+            self.recurrence_ids.append(event.recurrence_id)
+        # Lets overlapping() bound how far back an overlapping short event can
+        # start; the long ones are checked directly
+        self.long_events = [i for i, (s, e) in enumerate(zip(self.starts, self.ends))
+                            if e - s > LONG_EVENT]
+        self.max_duration = max((e - s for s, e in zip(self.starts, self.ends)
+                                 if e - s <= LONG_EVENT), default=0)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def event(self, i):
+        return Event(self.starts[i], self.ends[i], self.all_day[i], self.summaries[i],
+                     self.uids[i], self.recurrence_ids[i])
+
+    def starting_from(self, start, count):
+        """The first count events starting at or after start (epoch s)."""
+        i = bisect_left(self.starts, start)
+        return [self.event(j) for j in range(i, min(i + count, len(self)))]
+
+    def overlapping(self, start, end):
+        """Events overlapping [start, end) (epoch s), in start order."""
+        lo = bisect_left(self.starts, start - self.max_duration)
+        hi = bisect_left(self.starts, end)
+        # Long events starting before lo come first in start order; the
+        # ones from lo on are in the scanned range anyway
+        earlier = [i for i in self.long_events[:bisect_left(self.long_events, lo)]
+                   if self.ends[i] > start]
+        return [self.event(i) for i in earlier] + \
+            [self.event(i) for i in range(lo, hi) if self.ends[i] > start]
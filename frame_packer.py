@@ -0,0 +1,28 @@
+# -*- coding:utf-8 -*-
+"""The frame canvas and its packing into the panel payload.
+
+A frame is drawn on a single 'P' canvas whose palette indices are the
+panel's own pixel codes (0x0 black, 0x3 white, 0x4 red). What is drawn last
+wins, so there are no layers to merge, and the 4bpp payload is simply the
+canvas packed two pixels per byte ('P;4').
+"""
+from PIL import Image
+
+BLACK = 0x0
+WHITE = 0x3
+RED = 0x4
+# RGB preview colours of the palette indices above
+PALETTE = [0, 0, 0] * 3 + [255, 255, 255] + [160, 0, 0]
+
+def new_canvas(size, data=None):
+    """A white frame canvas, or one unpacked from a 4bpp payload."""
+    if data is None:
+        canvas = Image.new('P', size, WHITE)
+    else:
+        canvas = Image.frombytes('P', size, bytes(data), 'raw', 'P;4')
+    canvas.putpalette(PALETTE)
+    return canvas
+
+def pack_frame(canvas):
+    """The 4bpp payload sent by EPD.display_payload for a frame canvas."""
+    return canvas.tobytes('raw', 'P;4')
@@ -0,0 +1,146 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""Render frames on one host and serve them to thin clients.
+
+Each panel profile names the feeds for its upcoming list and day column.
+GET /frame/<profile> answers with the packed 4bpp payload, ready for
+EPD.display_payload, so a Pi running `main.py --server URL` never fetches,
+parses or renders anything itself.
+
+- The ETag is the frame fingerprint without the clock (see epd_compat), so
+  a client sending it back in If-None-Match gets 304 until something other
+  than the clock changes.
+- X-Next-Refresh suggests when to ask again: the next event boundary, as in
+  daemon mode.
+- Frames are rendered at most once a minute and cached by a hash of their
+  inputs, so panels whose profiles share the same calendars share renders.
+
+    python frame_server.py --profiles profiles.json --port 8080
+
+profiles.json: {"kitchen": {"upcoming": ["https://..."], "day": "https://..."}}.
+Without it there is one profile, "default", from secrets.json.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import main
+from epd_compat import SimEPD, frame_fingerprint
+from frame_packer import pack_frame
+
+# Feeds are revalidated at most this often, in minutes
+FEED_CACHE_MINUTES = 5
+# Rendered frames kept in memory
+MAX_FRAMES = 64
+
+class FrameCache:
+    def __init__(self, profiles):
+        self.profiles = profiles
+        self.fonts = main.load_fonts()
+        self.epd = SimEPD()
+        self.frames = OrderedDict()
+        self.digests = weakref.WeakKeyDictionary()
+        # PIL drawing and the frame cache are not shared between threads
+        self.lock = threading.Lock()
+
+    def _calendar(self, url):
+        if url.startswith("webcal://"):
+            url = url.replace("webcal://", "https://", 1)
+        return main.get_cached_calendar(url, cache_time_minutes=FEED_CACHE_MINUTES)
+
+    def _digest(self, snapshot):
+        # Hash each snapshot once; they are reused until their feed changes
+        if snapshot is None:
+            return None
+        digest = self.digests.get(snapshot)
+        if digest is None:
+            digest = hashlib.sha1(json.dumps(snapshot.events).encode()).hexdigest()
+            self.digests[snapshot] = digest
+        return digest
+
+    def frame(self, name):
+        """Return (payload, etag, next refresh) for a profile, or None if
+        there is no such profile."""
+        profile = self.profiles.get(name)
+        if profile is None:
+            return None
+        upcoming = [s for s in map(self._calendar, profile["upcoming"]) if s is not None]
+        day = self._calendar(profile["day"])
+        now = datetime.now(main.LOCAL_TZ).replace(second=0, microsecond=0)
+        key = (main.STATIC_LAYOUT_VERSION, now, self._digest(day),
+               tuple(self._digest(s) for s in upcoming))
+        with self.lock:
+            cached = self.frames.get(key)
+            if cached is None:
+                cached = self._render(upcoming, day, now)
+                self.frames[key] = cached
+                while len(self.frames) > MAX_FRAMES:
+                    self.frames.popitem(last=False)
+            self.frames.move_to_end(key)
+        calendars = upcoming + ([day] if day is not None else [])
+        return cached + (main.next_refresh_time(calendars, now),)
+
+    def _render(self, upcoming, day, now):
+        frame = main.draw_frame(self.epd, self.fonts, lambda: upcoming, lambda: day, now=now)
+        payload = pack_frame(frame.canvas)
+        fingerprint = frame_fingerprint(payload, self.epd.width, ignore=[frame.clock_box])
+        return payload, f'W/"{fingerprint}"'
+
+class FrameHandler(BaseHTTPRequestHandler):
+    cache = None
+
+    def do_GET(self):
+        prefix = "/frame/"
+        result = None
+        if self.path.startswith(prefix):
+            result = self.cache.frame(self.path[len(prefix):])
+        if result is None:
+            self.send_error(404, "Unknown profile")
+            return
+        payload, etag, next_refresh = result
+        not_modified = self.headers.get("If-None-Match") == etag
+        self.send_response(304 if not_modified else 200)
+        self.send_header("ETag", etag)
+        self.send_header("X-Next-Refresh", next_refresh.isoformat())
+        if not_modified:
+            self.end_headers()
+            return
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        logging.info("%s %s", self.address_string(), format % args)
+
+def load_profiles(path):
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    secrets = main.load_secrets()
+    return {"default": {"upcoming": [secrets["calendar1"]], "day": secrets["calendar2"]}}
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="serve packed frames to thin clients")
+    parser.add_argument('--profiles', help="JSON file of panel profiles")
+    parser.add_argument('--bind', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    FrameHandler.cache = FrameCache(load_profiles(args.profiles))
+    server = ThreadingHTTPServer((args.bind, args.port), FrameHandler)
+    logging.info("Serving frames on %s:%d", args.bind, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,81 @@
+# -*- coding:utf-8 -*-
+"""Conditional fetching of ICS feeds backed by an on-disk copy of the raw feed.
+
+Each URL gets two files in the cache directory, named after the md5 of the URL:
+<hash>.ics.gz holds the last body we received and <hash>.json holds the
+validators (ETag / Last-Modified) the server sent with it.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import time
+
+import metrics
+from cache_manager import CACHE_DIR, atomic_open, atomic_write, mark_used
+
+# Returned by fetch_ics when the server confirms our cached copy is current
+NOT_MODIFIED = object()
+# Bytes read from the response at a time; the body is never held in memory
+CHUNK_SIZE = 64 * 1024
+
+def cache_key(url):
+    return hashlib.md5(url.encode()).hexdigest()
+
+def _paths(url, cache_dir):
+    key = cache_key(url)
+    return cache_dir / f"{key}.ics.gz", cache_dir / f"{key}.json"
+
+def open_cached_ics(url, cache_dir=CACHE_DIR):
+    """Open the ICS feed last downloaded for url as a text file to iterate
+    line by line, or return None."""
+    body_file, _ = _paths(url, cache_dir)
+    mark_used(body_file)
+    try:
+        return gzip.open(body_file, 'rt', encoding='utf-8', errors='replace')
+    except OSError as e:
+        logging.error("Error reading cached ICS for %s: %s", url, e)
+        return None
+
+def fetch_ics(session, url, cache_dir=CACHE_DIR, timeout=10):
+    """Fetch an ICS feed, revalidating against the cached copy.
+
+    A changed feed is streamed to the cache in chunks and the path of the
+    cached copy is returned; read it with open_cached_ics. Returns
+    NOT_MODIFIED if the server answered 304 for our cached copy, or None if
+    the feed could not be fetched.
+    """
+    cache_dir.mkdir(exist_ok=True)
+    body_file, meta_file = _paths(url, cache_dir)
+    headers = {"Accept-Encoding": "gzip"}
+    if body_file.exists():
+        try:
+            meta = json.loads(meta_file.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            meta = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    with session.get(url, headers=headers, timeout=timeout, stream=True) as response:
+        if response.status_code == 304 and body_file.exists():
+            logging.info("Calendar not modified: %s", url)
+            return NOT_MODIFIED
+        if response.status_code != 200:
+            logging.error("Failed to fetch ICS file: HTTP %d", response.status_code)
+            return None
+        # A dropped connection keeps the old copy
+        with atomic_open(body_file, 'wb') as raw, gzip.open(raw, 'wb') as f:
+            received = 0
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                received += len(chunk)
+        metrics.count("http_bytes", received)
+    atomic_write(meta_file, json.dumps({
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "fetched_at": time.time(),
+    }))
+    return body_file
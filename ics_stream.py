@@ -0,0 +1,139 @@
+# -*- coding:utf-8 -*-
+"""Windowed reading of large ICS feeds.
+
+Shared calendars can be tens of MB of history, and parsing all of it builds
+every VEVENT in memory. The feed is instead read line by line and each VEVENT
+block is buffered on its own. Only events that can show up in the snapshot
+horizon are kept: recurring series, overrides of a recurrence, and single
+events overlapping the horizon. Everything outside VEVENTs (the calendar
+header, VTIMEZONEs) is kept as is. Memory then grows with the number of kept
+events, not with the size of the feed.
+
+The VEVENTs of recurring series can also be collected per UID instead, so
+series_cache can skip the ones it already expanded.
+"""
+import hashlib
+import re
+from datetime import date, timedelta
+
+# Properties that make an event part of a series
+SERIES_PROPERTIES = ('RRULE', 'RDATE', 'RECURRENCE-ID')
+# Event times are compared by date only, so allow a day either side for
+# time zones
+SLACK = timedelta(days=1)
+# Properties left out of a series' signature: some servers stamp every event
+# with the time of the export, which does not change what a series expands to
+VOLATILE_PROPERTIES = ('DTSTAMP',)
+
+_DURATION = re.compile(r'P(?:(\d+)W)?(?:(\d+)D)?')
+
+def unfolded_lines(lines):
+    """Join RFC 5545 folded lines (continuations start with a space or tab)."""
+    current = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t'):
+            if current is not None:
+                current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+def _property(line):
+    # "DTSTART;TZID=Europe/Paris:20240101T090000" -> ("DTSTART", "20240101T090000")
+    name, _, value = line.partition(':')
+    return name.split(';', 1)[0].upper(), value
+
+def _date(value):
+    return date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+
+def _in_window(block, start, end):
+    props = {}
+    for line in block:
+        name, value = _property(line)
+        if name in SERIES_PROPERTIES:
+            return True
+        props.setdefault(name, value)
+    try:
+        event_start = _date(props['DTSTART'])
+        if 'DTEND' in props:
+            event_end = _date(props['DTEND'])
+        else:
+            weeks, days = _DURATION.match(props.get('DURATION', 'P0D')).groups()
+            event_end = event_start + timedelta(weeks=int(weeks or 0), days=int(days or 0))
+    except (KeyError, ValueError, AttributeError):
+        # Leave anything we cannot read to the real parser
+        return True
+    return event_start <= end + SLACK and event_end >= start - SLACK
+
+def _series_uid(block):
+    uid = None
+    recurring = False
+    for line in block:
+        name, value = _property(line)
+        if name == 'UID':
+            uid = value
+        elif name in SERIES_PROPERTIES:
+            recurring = True
+    return uid if recurring else None
+
+def series_signature(lines):
+    """Hash of the lines of a series' VEVENTs, less VOLATILE_PROPERTIES."""
+    digest = hashlib.sha1()
+    for line in lines:
+        if _property(line)[0] not in VOLATILE_PROPERTIES:
+            digest.update(line.encode('utf-8', 'surrogatepass') + b'\n')
+    return digest.hexdigest()
+
+def series_end(blocks):
+    """A date no occurrence of the series in blocks starts after, or None if
+    the series is open-ended (an RRULE without UNTIL) or cannot be read."""
+    last = None
+    try:
+        for block in blocks:
+            for line in block:
+                name, value = _property(line)
+                if name == 'RRULE':
+                    parts = dict(part.split('=', 1) for part in value.upper().split(';')
+                                 if '=' in part)
+                    if 'UNTIL' not in parts:
+                        return None
+                    dates = [parts['UNTIL']]
+                elif name in ('DTSTART', 'RDATE', 'RECURRENCE-ID'):
+                    dates = value.split(',')
+                else:
+                    continue
+                for text in dates:
+                    day = _date(text)
+                    if last is None or day > last:
+                        last = day
+    except ValueError:
+        return None
+    return last + SLACK if last else None
+
+def windowed_ics(lines, start, end, series=None):
+    """Yield the unfolded lines of the feed with the VEVENTs that cannot
+    overlap the dates [start, end] left out.
+
+    If series is a dict, the VEVENTs of recurring series are not yielded but
+    added to it: a list of VEVENT blocks (lists of lines) per UID."""
+    block = None
+    for line in unfolded_lines(lines):
+        upper = line.upper()
+        if block is None:
+            if upper == 'BEGIN:VEVENT':
+                block = [line]
+            else:
+                yield line
+            continue
+        block.append(line)
+        if upper == 'END:VEVENT':
+            uid = _series_uid(block) if series is not None else None
+            if uid:
+                series.setdefault(uid, []).append(block)
+            elif _in_window(block, start, end):
+                yield from block
+            block = None
@@ -0,0 +1,67 @@
+# -*- coding:utf-8 -*-
+"""Cache of the pre-rendered static parts of the dashboard.
+
+The static content is drawn once per key and stored packed: the frame
+canvas at 4 bits per pixel, as in the panel payload, followed by a 1 bit per
+pixel overlay mask of the static pixels that must stay on top of what a
+frame draws (the hour grid drawn over red event blocks).
+"""
+import hashlib
+import logging
+import os
+from functools import lru_cache
+from PIL import Image, ImageDraw
+
+import metrics
+from cache_manager import CACHE_DIR, atomic_write, mark_used
+from frame_packer import new_canvas
+
+# Packed layers already loaded or rendered by this process, keyed by key
+_loaded = {}
+
+@lru_cache(maxsize=8)
+def _file_digest(path, mtime, size):
+    # mtime and size are only part of the cache key, so an edited file is
+    # hashed again
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def font_identity(font):
+    """Identify a FreeType font by size and file contents, so a changed font
+    file invalidates the layers drawn with it. The file is only read again
+    once its modification time or size changes."""
+    stat = os.stat(font.path)
+    return (font.size, _file_digest(font.path, stat.st_mtime_ns, stat.st_size))
+
+def layer_key(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+
+def static_layers(key, size, draw, cache_dir=CACHE_DIR):
+    """Return a new frame canvas and its mode '1' overlay mask for key.
+
+    draw(canvas_draw, overlay_draw) renders the content the first time;
+    overlay_draw starts all black and fill=255 marks the pixels to paste
+    back in black once the frame is drawn.
+    """
+    width, height = size
+    canvas_bytes = width // 2 * height
+    mask_bytes = width // 8 * height
+    packed = _loaded.get(key)
+    cache_file = cache_dir / f"static-{key}.bin"
+    if packed is None and cache_file.exists():
+        packed = cache_file.read_bytes()
+        mark_used(cache_file)
+        if len(packed) != canvas_bytes + mask_bytes:
+            logging.error("Ignoring static layer cache %s: wrong size", cache_file)
+            packed = None
+    metrics.count("static_layers_hit" if packed is not None else "static_layers_miss")
+    if packed is None:
+        logging.info("Rendering static layers %s", key)
+        canvas = new_canvas(size)
+        overlay = Image.new('1', size, 0)
+        draw(ImageDraw.Draw(canvas), ImageDraw.Draw(overlay))
+        packed = canvas.tobytes('raw', 'P;4') + overlay.tobytes()
+        atomic_write(cache_file, packed)
+    _loaded[key] = packed
+    return (new_canvas(size, packed[:canvas_bytes]),
+            Image.frombytes('1', size, packed[canvas_bytes:]))
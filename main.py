@@ -1,122 +1,319 @@
 #!/usr/bin/python
 # -*- coding:utf-8 -*-
+import time
+_STARTED = time.perf_counter()
 import os
+import argparse
 import logging
-import time
 import json
-import hashlib
+import heapq
 from zoneinfo import ZoneInfo
-from pathlib import Path
 from datetime import datetime, timedelta
-import pickle
-import requests
-from ical.calendar_stream import IcsCalendarStream
-from ical.exceptions import CalendarParseError
-from PIL import Image,ImageDraw,ImageFont
-from epd_compat import epd7in5bc
+from functools import lru_cache
+from collections import namedtuple
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+# requests and ical are slow to import on a Pi Zero and are only needed when
+# a feed is fetched or parsed, so they are imported there
+from PIL import ImageDraw, ImageFont
+from epd_compat import (epd7in5bc, frame_fingerprint, frame_changed, load_frame_state,
+                        refresh_due, save_frame_state)
+from cache_manager import CACHE_DIR, enforce_budget, mark_used
+from ics_cache import NOT_MODIFIED, cache_key, fetch_ics, open_cached_ics
+from event_snapshot import EventStore, load_snapshot, merged_events, save_snapshot
+from series_cache import feed_snapshot
+from layer_cache import font_identity, layer_key, static_layers
+from frame_packer import BLACK, RED, WHITE, pack_frame
+import metrics
 
 PIC_DIR = './pic'
 FONT_DIR = './font'
-
-with open("secrets.json", encoding="utf-8") as f:
-    secrets = json.load(f)
+# Refresh the panel even if the frame is unchanged after this many hours,
+# to clear ghosting. None disables the periodic refresh.
+FULL_REFRESH_HOURS = 24
+# Resolved once; set EINK_TZ to an IANA zone name to override
+LOCAL_TZ = ZoneInfo(os.environ.get("EINK_TZ", "America/Chicago"))
+# Daemon mode wakes at event boundaries, but never more often than
+# MIN_REFRESH_INTERVAL nor less often than MAX_REFRESH_INTERVAL.
+MIN_REFRESH_INTERVAL = timedelta(minutes=5)
+MAX_REFRESH_INTERVAL = timedelta(minutes=30)
+# Day column: DAY_WINDOW_HOURS starting at DAY_START_HOUR
+DAY_START_HOUR = 5
+DAY_WINDOW_HOURS = 22
+# Bump when draw_static changes so cached static layers are redrawn
+STATIC_LAYOUT_VERSION = 2
+# Calendars fetched in parallel by update_cal
+FETCH_WORKERS = 4
+# A stale snapshot is served while its feed revalidates in the background,
+# but never once it is older than this
+MAX_STALE_MINUTES = 24 * 60
+# Seconds a refresh waits on a revalidation before serving the stale snapshot
+REVALIDATE_WAIT = 5
+# Warn when imports, driver and font setup take longer than this, in seconds
+STARTUP_BUDGET = 1.5
+
+@lru_cache(maxsize=None)
+def load_secrets():
+    with open("secrets.json", encoding="utf-8") as f:
+        return json.load(f)
+
+# A rendered frame: its canvas, the clock's box and the calendars drawn
+Frame = namedtuple('Frame', 'canvas clock_box calendars')
+
+@lru_cache(maxsize=None)
+def http_session():
+    """Shared so repeated and concurrent fetches (e.g. in daemon mode) reuse
+    keep-alive connections."""
+    import requests
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=FETCH_WORKERS,
+                                            pool_maxsize=FETCH_WORKERS)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def fetch_calendar(key):
+    ics_url = load_secrets()[key]
+    # Support webcal:// URLs
+    if ics_url.startswith("webcal://"):
+        ics_url = ics_url.replace("webcal://", "https://", 1)
+    # Always revalidated, but an unchanged feed is neither downloaded
+    # nor parsed again
+    calendar = get_cached_calendar(ics_url, cache_time_minutes=0)
+    if calendar is None:
+        logging.error("Failed to load calendar for %s", key)
+    return calendar
 
 def update_cal(calendar_keys):
-    all_calendars = []
-    for key in calendar_keys:
-        ics_url = secrets[key]
-        # Support webcal:// URLs
-        if ics_url.startswith("webcal://"):
-            ics_url = ics_url.replace("webcal://", "https://", 1)
-        response = requests.get(ics_url, timeout=10)
-        if response.status_code == 200:
-            try:
-                calendar = IcsCalendarStream.calendar_from_ics(response.text)
-                all_calendars.append(calendar)
-            except CalendarParseError as err:
-                logging.error("Failed to parse calendar for %s: %s", key, err)
-
-    # Combine calendars if more than one.
-    if len(all_calendars) == 1:
-        return all_calendars[0]
-    elif len(all_calendars) > 1:
-        # Merge calendars - not a built-in function in ical, so we'll return the list
-        # and handle merging elsewhere
-        return all_calendars
-    else:
+    # Fetch every feed at once so the slowest one bounds the wait, not the sum
+    workers = max(1, min(FETCH_WORKERS, len(calendar_keys)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(fetch_calendar, calendar_keys)
+        all_calendars = [calendar for calendar in results if calendar is not None]
+
+    if not all_calendars:
         # No calendars parsed successfully
         logging.error("No calendars were successfully parsed")
-        return None
+    return all_calendars
 
-def process_upcoming_events(calendar, event_amt):
-    now = datetime.now(ZoneInfo("America/Chicago"))
-    today = now.date()
-    # Get all events from the calendar and sort by start time
-    events = sorted(calendar.timeline, key=lambda e: e.dtstart)
-    upcoming_events = []
-    for event in events:
-        event_date = event.dtstart.astimezone(ZoneInfo("America/Chicago")).date()
-        if event.dtstart > now or event_date == today:
-            upcoming_events.append(event)
-        if len(upcoming_events) >= event_amt:
-            break
+@lru_cache(maxsize=4)
+def event_store(calendars):
+    """EventStore of a tuple of snapshots, merged and deduplicated. Cached,
+    as a resident process keeps getting the same snapshot objects back."""
+    return EventStore(merged_events(calendars))
+
+def process_upcoming_events(calendars, draw, font, event_amt, now=None):
+    now = now or datetime.now(LOCAL_TZ)
+    # Everything starting today, including events already under way or over,
+    # and everything after
+    today = now.astimezone(LOCAL_TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+    upcoming_events = event_store(tuple(calendars)).starting_from(today.timestamp(), event_amt)
 
     if upcoming_events:
         for i, event in enumerate(upcoming_events[:event_amt]):
             y = 75 + i * 30
-            start_dt = event.dtstart.astimezone(ZoneInfo("America/Chicago"))
+            start_dt = event.dtstart.astimezone(LOCAL_TZ)
             start_str = start_dt.strftime('%m-%d @ %H:%M')
             name = event.summary
             if len(name) > 24:
                 name = name[:24] + ".."
-            drawblack.text((10, y), f"{start_str} - {name}", font=font20fs, fill=0)
-
-def get_cached_calendar(ics_url, cache_time_minutes=60):
-    cache_dir = Path('./cache')
-    cache_dir.mkdir(exist_ok=True)
-    # Create a filename based on the URL
-    url_hash = hashlib.md5(ics_url.encode()).hexdigest()
-    cache_file = cache_dir / f"{url_hash}.pickle"
-    # Check if cache exists and is recent enough
-    if cache_file.exists():
-        file_age_minutes = (time.time() - cache_file.stat().st_mtime) / 60
-        if file_age_minutes < cache_time_minutes:
-            try:
-                with open(cache_file, 'rb') as f:
-                    logging.info("Using cached calendar data (%.1f min old)", file_age_minutes)
-                    return pickle.load(f)
-            except Exception as e:
-                logging.error("Error loading cache: %s", e)
+            draw.text((10, y), f"{start_str} - {name}", font=font, fill=BLACK)
+
+# Event snapshots already loaded by this process, keyed by cache file
+loaded_snapshots = {}
+
+def load_cached_snapshot(cache_file):
+    # A resident process keeps the loaded snapshot around
+    mtime = cache_file.stat().st_mtime
+    loaded = loaded_snapshots.get(cache_file)
+    if loaded and loaded[0] == mtime:
+        metrics.count("snapshot_memory_hit")
+        return loaded[1]
+    with metrics.timed("snapshot_load"):
+        snapshot = load_snapshot(cache_file)
+    if snapshot is not None:
+        loaded_snapshots[cache_file] = (mtime, snapshot)
+    return snapshot
+
+def snapshot_file(ics_url):
+    return CACHE_DIR / f"{cache_key(ics_url)}.events.jsonl"
+
+# ical caches recurrence rules in module-level state that is not thread-safe,
+# so feeds fetched in parallel are parsed and expanded one at a time
+_parse_lock = threading.Lock()
+
+def series_file(ics_url):
+    return CACHE_DIR / f"{cache_key(ics_url)}.series.jsonl"
+
+def parse_feed(lines, now, name, series_path=None):
+    """Parse the ICS lines of a feed into a Snapshot of the horizon
+    starting at now, or return None; name is only used in log messages.
+
+    With series_path, recurring series expanded by earlier parses are
+    reused from it (see series_cache)."""
+    from ical.calendar_stream import IcsCalendarStream
+    from ical.exceptions import CalendarParseError
+    try:
+        with _parse_lock:
+            return feed_snapshot(lines, now, LOCAL_TZ, IcsCalendarStream.calendar_from_ics,
+                                 series_path)
+    except (OSError, EOFError) as err:
+        logging.error("Error reading ICS for %s: %s", name, err)
+        return None
+    except CalendarParseError as err:
+        logging.error("Failed to parse ics file from %s: %s", name, err)
+        return None
+    except Exception:
+        # One feed the parser chokes on must not take the whole frame down
+        logging.exception("Unexpected error parsing %s", name)
+        return None
+
+def revalidate_calendar(ics_url):
+    """Fetch the feed and return its event Snapshot, or None.
 
-    # Fetch and parse the calendar
+    The feed is only parsed when it changed or the cached snapshot's
+    horizon has run out, and then only the events that can fall inside the
+    new horizon (see ics_stream)."""
+    import requests
+    cache_file = snapshot_file(ics_url)
+    now = datetime.now(LOCAL_TZ)
     logging.info("Fetching fresh calendar data")
-    response = requests.get(ics_url, timeout=10)
-    if response.status_code != 200:
-        logging.error("Failed to fetch ICS file: HTTP %d", response.status_code)
-        return None
     try:
-        calendar = IcsCalendarStream.calendar_from_ics(response.text)
-        # Save to cache
-        with open(cache_file, 'wb') as f:
-            pickle.dump(calendar, f)
-        return calendar
-    except CalendarParseError as err:
-        logging.error("Failed to parse ics file from %s: %s", ics_url, err)
+        with metrics.timed("fetch"):
+            fetched = fetch_ics(http_session(), ics_url)
+    except requests.RequestException as err:
+        logging.error("Failed to fetch %s: %s", ics_url, err)
+        metrics.count("feed_error")
+        return None
+    if fetched is NOT_MODIFIED:
+        metrics.count("feed_not_modified")
+        snapshot = load_cached_snapshot(cache_file) if cache_file.exists() else None
+        if snapshot is not None and snapshot.covers(now):
+            cache_file.touch()
+            loaded_snapshots[cache_file] = (cache_file.stat().st_mtime, snapshot)
+            return snapshot
+    elif fetched is None:
         return None
+    feed = open_cached_ics(ics_url)
+    if feed is None:
+        return None
+    with feed:
+        snapshot = parse_feed(feed, now, ics_url, series_file(ics_url))
+    if snapshot is None:
+        return None
+    # Save to cache
+    save_snapshot(snapshot, cache_file)
+    loaded_snapshots[cache_file] = (cache_file.stat().st_mtime, snapshot)
+    return snapshot
+
+# Revalidations run here so a slow feed can finish after the frame is drawn;
+# the pool's threads are joined at exit, so the result still lands on disk
+_revalidator = ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+_revalidations = {}
+_revalidations_lock = threading.Lock()
+
+def revalidate_async(ics_url):
+    """Start revalidating a feed unless that is already under way; returns
+    the Future of its Snapshot."""
+    with _revalidations_lock:
+        future = _revalidations.get(ics_url)
+        if future is None or future.done():
+            future = _revalidator.submit(revalidate_calendar, ics_url)
+            _revalidations[ics_url] = future
+    return future
+
+def get_cached_calendar(ics_url, cache_time_minutes=60, max_stale_minutes=MAX_STALE_MINUTES):
+    """Return the event Snapshot for a feed, or None.
+
+    A snapshot younger than cache_time_minutes is used as is. An older one
+    is revalidated; if that takes longer than REVALIDATE_WAIT or fails, the
+    old snapshot is served while the revalidation carries on in the
+    background, up to max_stale_minutes old."""
+    cache_file = snapshot_file(ics_url)
+    snapshot = None
+    if cache_file.exists():
+        age_minutes = (time.time() - cache_file.stat().st_mtime) / 60
+        snapshot = load_cached_snapshot(cache_file)
+        if snapshot is not None and not snapshot.covers(datetime.now(LOCAL_TZ)):
+            snapshot = None
+        if snapshot is not None:
+            mark_used(cache_file)
+            if age_minutes < cache_time_minutes:
+                logging.info("Using cached calendar data (%.1f min old)", age_minutes)
+                metrics.count("feed_cache_hit")
+                return snapshot
+            if age_minutes >= max_stale_minutes:
+                snapshot = None
+
+    metrics.count("feed_cache_miss")
+    pending = revalidate_async(ics_url)
+    if snapshot is None:
+        return pending.result()
+    try:
+        fresh = pending.result(timeout=REVALIDATE_WAIT)
+    except FutureTimeoutError:
+        logging.warning("Feed is slow, using cached calendar data (%.1f min old) "
+                        "while it revalidates", age_minutes)
+        metrics.count("feed_stale_served")
+        return snapshot
+    if fresh is None:
+        logging.warning("Using cached calendar data (%.1f min old)", age_minutes)
+        metrics.count("feed_stale_served")
+        return snapshot
+    return fresh
+
+@lru_cache(maxsize=8)
+def layout_lanes(events):
+    """Assign overlapping events to side-by-side lanes.
+
+    events is a tuple sorted by start. Sweeps once over it with a min-heap of
+    the end times of the lanes in use, so the work is O(n log n). Returns a
+    tuple of (event, lane, lane count) where lane count is the number of lanes
+    needed by the group of mutually overlapping events it belongs to.
+    Cached, since the window's events rarely change between refreshes.
+    """
+    layout = []
+    active = []       # (end, lane) of events still running
+    free_lanes = []   # lanes released by events that have ended
+    group = []        # [event, lane] of the current overlapping group
+    group_lanes = 0
+
+    def close_group():
+        layout.extend((event, lane, group_lanes) for event, lane in group)
+        group.clear()
 
-# Update draw_day_blocks to accept a calendar object instead of a URL
-def draw_day_blocks(calendar, black_image, red_image, font, epd_width, epd_height):
+    for event in events:
+        while active and active[0][0] <= event.start:
+            heapq.heappush(free_lanes, heapq.heappop(active)[1])
+        if not active:
+            # Nothing overlaps this event, so the previous group is complete
+            close_group()
+            free_lanes.clear()
+            group_lanes = 0
+        if free_lanes:
+            lane = heapq.heappop(free_lanes)
+        else:
+            lane = group_lanes
+            group_lanes += 1
+        heapq.heappush(active, (event.end, lane))
+        group.append((event, lane))
+    close_group()
+    return tuple(layout)
+
+def day_window(now):
     # Time window: 5AM today to 3AM tomorrow (22 hours)
-    tz = ZoneInfo("America/Chicago")
-    now = datetime.now(tz)
-    start_time = now.replace(hour=5, minute=0, second=0, microsecond=0)
-    end_time = start_time + timedelta(hours=22)
+    start_time = now.replace(hour=DAY_START_HOUR, minute=0, second=0, microsecond=0)
+    return start_time, start_time + timedelta(hours=DAY_WINDOW_HOURS)
+
+# Update draw_day_blocks to accept a calendar object instead of a URL
+def draw_day_blocks(calendar, draw, font, epd_width, epd_height, now=None):
+    """Draw the day's events as red blocks. The hour grid drawn over them is
+    part of the static layers, see draw_hour_grid."""
+    now = now or datetime.now(LOCAL_TZ)
+    start_time, end_time = day_window(now)
     logging.info("Time window: %s to %s", start_time, end_time)
-    # Filter events within the date range
-    filtered_events = [
-        event for event in calendar.timeline
-        if (event.dtend > start_time and event.dtstart < end_time)
-    ]
+    filtered_events = event_store((calendar,)).overlapping(start_time.timestamp(),
+                                                           end_time.timestamp())
     logging.info("Found %d events in the range", len(filtered_events))
 
     # Block area: rightmost 200 pixels
@@ -128,30 +325,10 @@ def draw_day_blocks(calendar, black_image, red_image, font, epd_width, epd_heigh
     vertical_pixels = bottom - top
     pixels_per_minute = vertical_pixels / time_window_minutes
 
-    # First, calculate all hour marker positions
-    hour_positions = []
-    hours_to_draw = []
-    current_hour = start_time.hour
-    while True:
-        hours_to_draw.append(current_hour)
-        current_hour = (current_hour + 1) % 24
-        if current_hour == (end_time.hour + 1) % 24:
-            break
-
-    for hour in hours_to_draw:
-        marker_time = start_time.replace(hour=hour, minute=0)
-        if marker_time < start_time:
-            marker_time = marker_time + timedelta(days=1)  # Move to next day
-        if marker_time > end_time:
-            continue
-
-        # Calculate vertical position
-        minutes_from_start = (marker_time - start_time).total_seconds() / 60
-        y_marker = int(top + minutes_from_start * pixels_per_minute)
-        hour_positions.append((hour, y_marker))
-
-    # Draw timeline blocks for each event (in RED) FIRST
-    for event in filtered_events:
+    # Draw timeline blocks for each event (in RED) FIRST, overlapping
+    # events side by side in lanes
+    lane_area = block_right - (block_left + 2) + 1
+    for event, lane, lanes in layout_lanes(tuple(filtered_events)):
         # Clamp event start/end to the time window
         event_start = max(event.dtstart, start_time)
         event_end = min(event.dtend, end_time)
@@ -164,10 +341,19 @@ def draw_day_blocks(calendar, black_image, red_image, font, epd_width, epd_heigh
 
         # Calculate event duration in minutes
         event_duration_minutes = (event_end - event_start).total_seconds() / 60
-        # Draw event block in RED
-        red_image.rectangle([block_left + 2, y_start, block_right, y_end], outline=0, fill=0)
-        # Draw event summary text
-        summary = event.summary if len(event.summary) <= 15 else event.summary[:12] + "..."
+        # Draw event block in RED, leaving a 1px gap between lanes
+        x_left = block_left + 2 + lane * lane_area // lanes
+        x_right = block_left + 2 + (lane + 1) * lane_area // lanes - 1
+        if lane < lanes - 1:
+            x_right -= 1
+        # With more lanes than the area has pixel pairs, keep blocks 1px wide
+        x_right = max(x_left, x_right)
+        draw.rectangle([x_left, y_start, x_right, y_end], outline=RED, fill=RED)
+        # Draw event summary text, shortened to the lane width
+        max_chars = max(1, 15 // lanes)
+        summary = event.summary
+        if len(summary) > max_chars:
+            summary = summary[:max_chars - 3] + "..." if max_chars > 3 else summary[:max_chars]
         # For short events (less than 60 minutes), top-align the text
         text_y = y_start - 2  # Always top-align for short events
         # If event is longer than an hour, you could center it vertically
@@ -178,15 +364,51 @@ def draw_day_blocks(calendar, black_image, red_image, font, epd_width, epd_heigh
             block_height = y_end - y_start
             if block_height > text_height * 1.2:  # Ensure at least 20% extra space
                 text_y = y_start + (block_height - text_height) // 2
-        red_image.text((block_left + 5, text_y), summary, font=font, fill=255)
+        draw.text((x_left + 3, text_y), summary, font=font, fill=WHITE)
+
+def draw_hour_grid(draw, overlay, font, epd_width, epd_height):
+    """Draw the hour lines and labels of the day column.
 
-    # Draw hour markers and labels in BLACK AND RED LAST
+    They go on top of the event blocks: draw is the canvas and overlay a
+    mask of the pixels put back in black after the blocks are drawn."""
+    start_time, end_time = day_window(datetime.now(LOCAL_TZ))
+    block_left = epd_width - 200  # 440
+    block_right = epd_width - 1   # 639
+    top = 0
+    bottom = epd_height           # 384
+    time_window_minutes = (end_time - start_time).total_seconds() / 60
+    vertical_pixels = bottom - top
+    pixels_per_minute = vertical_pixels / time_window_minutes
+
+    # First, calculate all hour marker positions
+    hour_positions = []
+    hours_to_draw = []
+    current_hour = start_time.hour
+    while True:
+        hours_to_draw.append(current_hour)
+        current_hour = (current_hour + 1) % 24
+        if current_hour == (end_time.hour + 1) % 24:
+            break
+
+    for hour in hours_to_draw:
+        marker_time = start_time.replace(hour=hour, minute=0)
+        if marker_time < start_time:
+            marker_time = marker_time + timedelta(days=1)  # Move to next day
+        if marker_time > end_time:
+            continue
+
+        # Calculate vertical position
+        minutes_from_start = (marker_time - start_time).total_seconds() / 60
+        y_marker = int(top + minutes_from_start * pixels_per_minute)
+        hour_positions.append((hour, y_marker))
+
+    # Draw hour markers and labels in BLACK, also marked on the overlay
     for hour, y_marker in hour_positions:
-        # Draw solid line in BLACK (on black layer)
-        black_image.line([block_left, y_marker, block_right, y_marker], fill=0, width=1)
+        # Draw solid line in BLACK
+        draw.line([block_left, y_marker, block_right, y_marker], fill=BLACK, width=1)
 
-        # Also draw the same line in WHITE (on red layer)
-        red_image.line([block_left, y_marker, block_right, y_marker], fill=255, width=1)
+        # Mark the same line so it stays black over red blocks
+        overlay.line([block_left, y_marker, block_right, y_marker], fill=255, width=1)
 
         # Use 24-hour format without am/pm
         hour_marker_str = f"{hour}"
@@ -203,72 +425,322 @@ def draw_day_blocks(calendar, black_image, red_image, font, epd_width, epd_heigh
         text_x = block_right - text_width - 5
         text_y = y_marker
 
-        # Draw hour text at right edge in BLACK (on black layer)
-        black_image.text((text_x, text_y), hour_marker_str, font=font, fill=0)
-
-        # Also draw the same text in WHITE (on red layer)
-        red_image.text((text_x, text_y), hour_marker_str, font=font, fill=255)
-
-logging.basicConfig(level=logging.DEBUG)
-
-try:
-    logging.info("epd7in5bc Demo")
-    epd = epd7in5bc.EPD()
-    logging.info("init and Clear")
-    epd.init()
-    epd.Clear()
-
-    # Drawing on the image
-    logging.info("Drawing")
-    font24fs = ImageFont.truetype(os.path.join(FONT_DIR, 'FSEX302.ttf'), 24)
-    font18fs = ImageFont.truetype(os.path.join(FONT_DIR, 'FSEX302.ttf'), 18)
-    font20fs = ImageFont.truetype(os.path.join(FONT_DIR, 'FSEX302.ttf'), 20)
-    font32fs = ImageFont.truetype(os.path.join(FONT_DIR, 'FSEX302.ttf'), 32)
-    font48fs = ImageFont.truetype(os.path.join(FONT_DIR, 'FSEX302.ttf'), 48)
-
-
-    # Drawing on the Horizontal image
-    logging.info("1.Drawing on the Horizontal image...")
-    HBlackimage = Image.new('1', (epd.width, epd.height), 255)
-    HRimage = Image.new('1', (epd.width, epd.height), 255)
-    drawblack = ImageDraw.Draw(HBlackimage)
-    drawred = ImageDraw.Draw(HRimage)
-    drawblack.line((0, 60, epd.width-200, 60), fill = 0, width=3)
-    drawblack.line((epd.width - 200, 0, epd.width - 200, epd.height), fill = 0, width=3)
-
-    now_dt = datetime.now()
+        # Draw hour text at right edge in BLACK
+        draw.text((text_x, text_y), hour_marker_str, font=font, fill=BLACK)
+
+        # Mark the same text so it stays black over red blocks
+        overlay.text((text_x, text_y), hour_marker_str, font=font, fill=255)
+
+def load_fonts():
+    # Loaded once per process; the daemon reuses them for every refresh
+    return {size: ImageFont.truetype(os.path.join(FONT_DIR, 'FSEX302.ttf'), size)
+            for size in (18, 20, 24, 32, 48)}
+
+def draw_static(draw, overlay, fonts, epd_width, epd_height):
+    """Draw everything that does not change between refreshes."""
+    draw.line((0, 60, epd_width-200, 60), fill = BLACK, width=3)
+    draw.line((epd_width - 200, 0, epd_width - 200, epd_height), fill = BLACK, width=3)
+    draw_hour_grid(draw, overlay, fonts[18], epd_width, epd_height)
+
+def render_frame(epd, fonts):
+    """Fetch the calendars and draw both layers into a Frame."""
+    # Both feeds are fetched in the background while the chrome is drawn
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        # calendar1 is always revalidated, calendar2 is cached for an hour
+        upcoming = pool.submit(update_cal, ["calendar1"])
+        day = pool.submit(get_cached_calendar, load_secrets()["calendar2"])
+        return draw_frame(epd, fonts, upcoming.result, day.result)
+
+def chrome_layers(epd, fonts):
+    """The canvas and overlay of the cached chrome (see draw_static)."""
+    key = layer_key(STATIC_LAYOUT_VERSION, epd.width, epd.height, font_identity(fonts[18]),
+                    DAY_START_HOUR, DAY_WINDOW_HOURS)
+    return static_layers(
+        key, (epd.width, epd.height),
+        lambda draw, overlay: draw_static(draw, overlay, fonts, epd.width, epd.height))
+
+def draw_frame(epd, fonts, upcoming, day, now=None):
+    """Draw the canvas into a Frame as of now (default: the clock).
+
+    upcoming() returns the list of snapshots for the upcoming events list
+    and day() the snapshot for the day column, or None; each is only called
+    when its part is drawn, so they can wait on fetches still under way."""
+    logging.info("Drawing on the Horizontal image...")
+    # The canvas starts from the cached chrome; the chrome's overlay is put
+    # back on top once the dynamic content is drawn
+    canvas, overlay = chrome_layers(epd, fonts)
+    draw = ImageDraw.Draw(canvas)
+
+    now_dt = now or datetime.now()
     date_str = now_dt.strftime('%Y-%m-%d')
     time_str = now_dt.strftime('%H:%M:%S')
     # Draw date
-    drawred.text((10, 0), date_str, font=font48fs, fill=0)
+    draw.text((10, 0), date_str, font=fonts[48], fill=RED)
     # Draw time to the right of the date
     # Estimate width of date text for positioning
-    left, top, right, bottom = font48fs.getbbox(date_str)
+    left, top, right, bottom = fonts[48].getbbox(date_str)
     date_width = right - left
     # Use a smaller font for the time
-    drawred.text((10 + date_width + 10, 10), time_str, font=font18fs, fill=0)
-
-    # Get calendar1 (always fresh)
-    calendar1_events = update_cal(["calendar1"])
-    process_upcoming_events(calendar1_events, event_amt=7)
-
-    # Get calendar2 (cached)
-    ics_url = secrets["calendar2"]
-    calendar2 = get_cached_calendar(ics_url)
+    draw.text((10 + date_width + 10, 10), time_str, font=fonts[18], fill=RED)
+    # The clock alone should not trigger a refresh
+    clock_box = draw.textbbox((10 + date_width + 10, 10), time_str, font=fonts[18])
+
+    calendars = []
+    # Time spent waiting on fetches is reported apart from drawing
+    with metrics.timed("feed_wait"):
+        calendar1 = upcoming()
+    if calendar1:
+        process_upcoming_events(calendar1, draw, fonts[20], event_amt=7, now=now)
+        calendars.extend(calendar1)
+
+    with metrics.timed("feed_wait"):
+        calendar2 = day()
     if calendar2:
-        draw_day_blocks(calendar2, drawblack, drawred, font18fs, epd.width, epd.height)
+        draw_day_blocks(calendar2, draw, fonts[18], epd.width, epd.height,
+                        now=now)
+        calendars.append(calendar2)
     else:
         logging.error("Failed to get calendar2, skipping day blocks")
 
-    epd.display(epd.getbuffer(HBlackimage), epd.getbuffer(HRimage))
+    # Keep the hour grid black on top of the red event blocks
+    canvas.paste(BLACK, mask=overlay)
+    return Frame(canvas, clock_box, calendars)
+
+def prepare_frame(epd, fonts):
+    """Render and pack a frame; returns (frame, payload, fingerprint)."""
+    with metrics.timed("render"):
+        frame = render_frame(epd, fonts)
+    with metrics.timed("pack"):
+        payload = pack_frame(frame.canvas)
+        fingerprint = frame_fingerprint(payload, epd.width, ignore=[frame.clock_box])
+    metrics.count("payload_bytes", len(payload))
+    return frame, payload, fingerprint
+
+def init_panel(epd):
+    with metrics.timed("panel_init"):
+        epd.init()
+    with metrics.timed("panel_clear"):
+        epd.Clear()
+
+def show_payload(epd, payload, fingerprint):
+    """Send an initialized panel the frame, then put it to sleep."""
+    with metrics.timed("panel_display"):
+        epd.display_payload(payload)
+    save_frame_state(fingerprint)
     time.sleep(2)
     logging.info("Goto Sleep...")
-    epd.sleep()
+    with metrics.timed("panel_sleep"):
+        epd.sleep()
+    for phase, seconds in epd.busy_waits:
+        logging.info("Panel busy (%s): %.2f s", phase, seconds)
+        metrics.add_time("busy_" + phase.replace(" ", "_"), seconds)
+    metrics.add_time("spi", epd.spi_seconds)
+    metrics.count("spi_bytes", epd.spi_bytes)
+
+def refresh(epd, fonts, pipeline=False):
+    """Render a frame and push it to the panel if it changed.
+
+    With pipeline=True and a refresh certain whatever the frame (see
+    refresh_due), the panel is initialized and cleared while the frame is
+    fetched and rendered on a worker thread. Otherwise the frame has to be
+    rendered first to know whether the panel needs touching at all."""
+    started = time.monotonic()
+    enforce_budget()
+    if pipeline and refresh_due(FULL_REFRESH_HOURS):
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            prepared = pool.submit(prepare_frame, epd, fonts)
+            logging.info("init and Clear while rendering")
+            init_panel(epd)
+            try:
+                frame, payload, fingerprint = prepared.result()
+            except Exception:
+                epd.sleep()
+                raise
+    else:
+        frame, payload, fingerprint = prepare_frame(epd, fonts)
+        if not frame_changed(fingerprint, FULL_REFRESH_HOURS):
+            logging.info("Frame unchanged, skipping panel refresh")
+            return frame.calendars
+        logging.info("init and Clear")
+        init_panel(epd)
+    show_payload(epd, payload, fingerprint)
+    logging.info("Refresh took %.1f s", time.monotonic() - started)
+    return frame.calendars
+
+def next_refresh_time(calendars, now, min_interval=MIN_REFRESH_INTERVAL,
+                      max_interval=MAX_REFRESH_INTERVAL):
+    """Pick the next wake-up: the first event start or end after now, the
+    next midnight, or now + max_interval, whichever comes first."""
+    earliest = now + min_interval
+    wake = min(now + max_interval,
+               (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0))
+    for calendar in calendars:
+        for event in event_store((calendar,)).overlapping(earliest.timestamp(),
+                                                          wake.timestamp()):
+            for boundary in (event.dtstart, event.dtend):
+                if earliest <= boundary < wake:
+                    wake = boundary
+    return max(wake, earliest).astimezone(LOCAL_TZ)
+
+def power_down():
+    """Cut the panel's power after a failed refresh, without waiting on the
+    panel to go through its own power-off sequence."""
+    epdconfig = getattr(epd7in5bc, "epdconfig", None)
+    if epdconfig is None:
+        return
+    try:
+        epdconfig.module_exit()
+    except Exception:
+        logging.exception("Failed to power down the panel")
+
+def run_daemon(epd, fonts, pipeline=False):
+    """Stay resident and refresh at event boundaries, keeping fonts, the
+    HTTP session, cached calendars and the driver loaded between runs.
+
+    A failed refresh is logged, the panel powered down and the refresh
+    retried after MIN_REFRESH_INTERVAL."""
+    while True:
+        calendars = None
+        try:
+            with metrics.timed("refresh"):
+                calendars = refresh(epd, fonts, pipeline)
+        except Exception:
+            logging.exception("Refresh failed, retrying in %s", MIN_REFRESH_INTERVAL)
+            metrics.count("refresh_error")
+            power_down()
+        try:
+            metrics.write()
+        except OSError as err:
+            logging.error("Failed to write metrics: %s", err)
+        now = datetime.now(LOCAL_TZ)
+        if calendars is None:
+            wake = now + MIN_REFRESH_INTERVAL
+        else:
+            wake = next_refresh_time(calendars, now)
+        logging.info("Next refresh at %s", wake)
+        time.sleep(max(0, (wake - datetime.now(LOCAL_TZ)).total_seconds()))
+
+def refresh_from_server(epd, url):
+    """Thin client: download the packed frame from frame_server.py and send
+    it to the panel if it changed. Returns the server's suggested next
+    refresh time, or None."""
+    import requests
+    headers = {}
+    state = load_frame_state()
+    # Without a validator the server always sends the frame, e.g. when the
+    # periodic full refresh is due
+    if state and not frame_changed(state.get("fingerprint"), FULL_REFRESH_HOURS):
+        headers["If-None-Match"] = state["fingerprint"]
+    try:
+        with metrics.timed("fetch_frame"):
+            response = http_session().get(url, headers=headers, timeout=30)
+    except requests.RequestException as err:
+        logging.error("Failed to fetch frame from %s: %s", url, err)
+        return None
+    next_refresh = response.headers.get("X-Next-Refresh")
+    try:
+        next_refresh = datetime.fromisoformat(next_refresh) if next_refresh else None
+    except ValueError:
+        logging.warning("Ignoring bad X-Next-Refresh from %s: %r", url, next_refresh)
+        next_refresh = None
+    if next_refresh is not None and next_refresh.tzinfo is None:
+        next_refresh = next_refresh.replace(tzinfo=LOCAL_TZ)
+    if response.status_code == 304:
+        logging.info("Frame unchanged, skipping panel refresh")
+        return next_refresh
+    payload = response.content
+    if response.status_code != 200 or len(payload) != epd.width // 2 * epd.height:
+        logging.error("Bad frame from %s: HTTP %d, %d bytes", url, response.status_code,
+                      len(payload))
+        return None
+    logging.info("init and Clear")
+    init_panel(epd)
+    show_payload(epd, payload, response.headers.get("ETag"))
+    return next_refresh
+
+def run_thin_client(epd, url, daemon):
+    """Show frames from the server once, or repeatedly with daemon. As in
+    run_daemon, a failed refresh is logged, the panel powered down and the
+    refresh retried after MIN_REFRESH_INTERVAL."""
+    if not daemon:
+        with metrics.timed("refresh"):
+            refresh_from_server(epd, url)
+        metrics.write()
+        return
+    while True:
+        wake = None
+        try:
+            with metrics.timed("refresh"):
+                wake = refresh_from_server(epd, url)
+        except Exception:
+            logging.exception("Refresh failed, retrying in %s", MIN_REFRESH_INTERVAL)
+            metrics.count("refresh_error")
+            power_down()
+        try:
+            metrics.write()
+        except OSError as err:
+            logging.error("Failed to write metrics: %s", err)
+        now = datetime.now(LOCAL_TZ)
+        wake = min(max(wake or now, now + MIN_REFRESH_INTERVAL), now + MAX_REFRESH_INTERVAL)
+        logging.info("Next refresh at %s", wake.astimezone(LOCAL_TZ))
+        time.sleep(max(0, (wake - datetime.now(LOCAL_TZ)).total_seconds()))
+
+def report_startup(imported, ready):
+    """Log how long imports and setup took, warning past STARTUP_BUDGET."""
+    total = ready - _STARTED
+    logging.info("Startup: imports %.0f ms, driver and fonts %.0f ms, total %.0f ms",
+                 (imported - _STARTED) * 1000, (ready - imported) * 1000, total * 1000)
+    if total > STARTUP_BUDGET:
+        logging.warning("Startup took %.2f s, over the %.2f s budget", total, STARTUP_BUDGET)
+
+def main():
+    parser = argparse.ArgumentParser(description="e-ink calendar dashboard")
+    parser.add_argument('--daemon', action='store_true',
+                        help="stay resident and refresh at event boundaries")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="when a refresh is due anyway (no saved frame, or the "
+                             "periodic full refresh), fetch and render while the panel "
+                             "initializes and clears")
+    parser.add_argument('--server', metavar='URL',
+                        help="thin client: display frames from frame_server.py, e.g. "
+                             "http://host:8080/frame/default")
+    parser.add_argument('--metrics', metavar='DIR',
+                        help="write per-stage timings and counters of each run to DIR "
+                             "(metrics.jsonl and a Prometheus textfile)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG)
+    if args.metrics:
+        metrics.enable(args.metrics)
+
+    try:
+        logging.info("epd7in5bc Demo")
+        imported = time.perf_counter()
+        epd = epd7in5bc.EPD()
+        if args.server:
+            run_thin_client(epd, args.server, args.daemon)
+            return
+        fonts = load_fonts()
+        report_startup(imported, time.perf_counter())
+        if args.daemon:
+            run_daemon(epd, fonts, args.pipeline)
+        else:
+            with metrics.timed("refresh"):
+                refresh(epd, fonts, args.pipeline)
+            metrics.write()
+
+    except TimeoutError as e:
+        # ReadBusy gave up on the panel; do not leave it powered
+        logging.error("Panel did not respond: %s", e)
+        power_down()
+
+    except IOError as e:
+        logging.info(e)
 
-except IOError as e:
-    logging.info(e)
+    except KeyboardInterrupt:
+        logging.info("ctrl + c:")
+        epd7in5bc.epdconfig.module_exit(cleanup=True)
+        exit()
 
-except KeyboardInterrupt:
-    logging.info("ctrl + c:")
-    epd7in5bc.epdconfig.module_exit(cleanup=True)
-    exit()
+if __name__ == '__main__':
+    main()
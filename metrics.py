@@ -0,0 +1,89 @@
+# -*- coding:utf-8 -*-
+"""Per-run timings and counters.
+
+Stages are timed with `with timed("parse"):`, and counts such as bytes or
+cache hits are added with count(). Both do nothing until enable() is
+called, and even then each call only costs a clock read and a dict update.
+write() appends the run to a JSON lines file and replaces a Prometheus
+textfile-collector file in the enabled directory, then starts a new run.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from cache_manager import atomic_write
+
+JSONL_FILE = "metrics.jsonl"
+PROM_FILE = "eink_cal.prom"
+
+_enabled = False
+_directory = None
+_lock = threading.Lock()
+_stages = {}     # stage -> [seconds, calls]
+_counters = {}   # name -> value
+
+def enable(directory):
+    """Start recording; runs are written to directory."""
+    global _enabled, _directory
+    _enabled = True
+    _directory = Path(directory)
+
+def add_time(stage, seconds):
+    if not _enabled:
+        return
+    with _lock:
+        entry = _stages.setdefault(stage, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+@contextmanager
+def timed(stage):
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(stage, time.perf_counter() - start)
+
+def count(name, value=1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def _prometheus(run):
+    lines = ["# HELP eink_cal_stage_seconds Time spent in each stage of the last run.",
+             "# TYPE eink_cal_stage_seconds gauge"]
+    for stage, entry in sorted(run["stages"].items()):
+        lines.append(f'eink_cal_stage_seconds{{stage="{stage}"}} {entry["seconds"]:.6f}')
+    lines += ["# HELP eink_cal_count Bytes, cache hits and other counts of the last run.",
+              "# TYPE eink_cal_count gauge"]
+    for name, value in sorted(run["counters"].items()):
+        lines.append(f'eink_cal_count{{name="{name}"}} {value}')
+    lines += ["# HELP eink_cal_last_run_timestamp_seconds When the last run finished.",
+              "# TYPE eink_cal_last_run_timestamp_seconds gauge",
+              f'eink_cal_last_run_timestamp_seconds {run["time"]:.3f}']
+    return "\n".join(lines) + "\n"
+
+def write():
+    """Write the run recorded so far and start a new one."""
+    if not _enabled:
+        return
+    with _lock:
+        run = {
+            "time": time.time(),
+            "stages": {stage: {"seconds": seconds, "calls": calls}
+                       for stage, (seconds, calls) in _stages.items()},
+            "counters": dict(_counters),
+        }
+        _stages.clear()
+        _counters.clear()
+    _directory.mkdir(parents=True, exist_ok=True)
+    with open(_directory / JSONL_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps(run) + "\n")
+    # node_exporter may read the file at any time, so replace it atomically
+    atomic_write(_directory / PROM_FILE, _prometheus(run))
@@ -0,0 +1,136 @@
+# -*- coding:utf-8 -*-
+"""Expanded occurrences of a feed's recurring series, kept between parses.
+
+Expanding an RRULE walks it from the series' first occurrence, so a feed
+with years of daily and weekly series spends most of a rebuild there, even
+when a single event changed. Each series (the VEVENTs sharing a UID: its
+master and overrides) is instead expanded once, and its occurrences are
+stored next to the event snapshot with a signature of its VEVENT text. On
+the next rebuild a series is:
+
+- reused without being parsed at all while its text is unchanged and its
+  occurrences reach past the horizon, or when it ended before they stop;
+- expanded again, keeping only the occurrences past where the stored ones
+  stop, once the horizon has moved beyond them;
+- expanded from scratch when its RRULE, EXDATE, overrides or anything else
+  in its VEVENTs changed, and every series is when the calendar's time
+  zones do.
+
+Occurrences that ended before the horizon are dropped and new ones are
+added at most SERIES_LOOKAHEAD past it, so the lists follow the horizon.
+"""
+import json
+import logging
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+import metrics
+from cache_manager import atomic_open
+from event_snapshot import Event, Snapshot, expand_events, snapshot_horizon
+from ics_stream import series_end, series_signature, windowed_ics
+
+SERIES_VERSION = 1
+# How far past the horizon series are expanded, so the daily move of the
+# horizon does not re-expand every series each day
+SERIES_LOOKAHEAD = timedelta(days=7)
+
+# Occurrences of one series: those overlapping [start, until) (epoch s)
+Series = namedtuple('Series', 'signature start until events')
+
+def load_series(path, context):
+    """Load the series saved at path as {uid: Series}, or {} if the file is
+    missing, corrupt, or was saved for another format or context."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if header.get("version") != SERIES_VERSION or header.get("context") != context:
+                return {}
+            series = {}
+            for line in f:
+                uid, signature, start, until, events = json.loads(line)
+                series[uid] = Series(signature, start, until, [Event(*e) for e in events])
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, TypeError) as e:
+        logging.error("Error loading series cache %s: %s", path, e)
+        return {}
+    return series
+
+def save_series(path, context, series):
+    with atomic_open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({"version": SERIES_VERSION, "context": context}) + "\n")
+        for uid, entry in series.items():
+            f.write(json.dumps([uid, *entry], ensure_ascii=False) + "\n")
+
+def _calendar_lines(feed):
+    # The lines outside VEVENTs: the calendar's properties and time zones
+    inside = False
+    for line in feed:
+        upper = line.upper()
+        if upper == 'BEGIN:VEVENT':
+            inside = True
+        elif upper == 'END:VEVENT':
+            inside = False
+        elif not inside:
+            yield line
+
+def _ended(blocks, until, tz):
+    # True if no occurrence of the series can start at or after until
+    last = series_end(blocks)
+    return last is not None and \
+        datetime.combine(last + timedelta(days=1), time(), tz).timestamp() <= until
+
+def feed_snapshot(lines, now, tz, parse, path=None):
+    """Parse the ICS lines of a feed into the Snapshot of the horizon
+    starting at now.
+
+    parse(ics) turns ICS text into an ical Calendar. With path, expanded
+    series are reused from that file and saved back to it."""
+    start, end = snapshot_horizon(now, tz)
+    start_ts, end_ts = start.timestamp(), end.timestamp()
+    expand_end = end + SERIES_LOOKAHEAD
+    blocks = {}
+    with metrics.timed("parse"):
+        feed = list(windowed_ics(lines, start.date(), end.date(), series=blocks))
+        context = series_signature([str(tz), *_calendar_lines(feed)])
+        cached = load_series(path, context) if path else {}
+        series, pending = {}, {}
+        for uid, uid_blocks in blocks.items():
+            signature = series_signature(line for block in uid_blocks for line in block)
+            entry = cached.get(uid)
+            if entry is None or entry.signature != signature or entry.start > start_ts:
+                pending[uid] = Series(signature, start_ts, None, [])
+                continue
+            entry = entry._replace(start=start_ts,
+                                   events=[e for e in entry.events if e.end > start_ts])
+            if entry.until < end_ts and not _ended(uid_blocks, entry.until, tz):
+                pending[uid] = entry
+            else:
+                series[uid] = entry
+        # Parse the single events along with the series to expand, inside
+        # the calendar so their time zones resolve
+        close = next((i for i in range(len(feed) - 1, -1, -1)
+                      if feed[i].upper() == 'END:VCALENDAR'), len(feed))
+        extra = [line for uid in pending for block in blocks[uid] for line in block]
+        calendar = parse("\n".join(feed[:close] + extra + feed[close:]))
+
+    with metrics.timed("expand"):
+        events = []
+        for event in expand_events(calendar, start, expand_end if pending else end, tz):
+            entry = pending.get(event.uid)
+            if entry is None:
+                if event.start < end_ts:
+                    events.append(event)
+            elif entry.until is None or event.start >= entry.until:
+                entry.events.append(event)
+        for uid, entry in pending.items():
+            series[uid] = entry._replace(until=expand_end.timestamp())
+        for entry in series.values():
+            events.extend(e for e in entry.events if e.start < end_ts)
+        events.sort(key=lambda e: (e.start, e.end))
+    logging.info("Expanded %d of %d recurring series", len(pending), len(blocks))
+    metrics.count("series_reused", len(blocks) - len(pending))
+    metrics.count("series_expanded", len(pending))
+    if path:
+        save_series(path, context, series)
+    return Snapshot(events, start_ts, end_ts)
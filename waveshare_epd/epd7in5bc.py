@@ -29,12 +29,21 @@
 
 
 import logging
+import time
+from PIL import Image, ImageChops
 from . import epdconfig
 
 # Display resolution
 EPD_WIDTH       = 640
 EPD_HEIGHT      = 384
 
+# spidev's default transfer buffer (/sys/module/spidev/parameters/bufsiz)
+SPI_CHUNK_SIZE  = 4096
+# Longest a busy phase may take before ReadBusy gives up, in seconds
+BUSY_TIMEOUT    = 60
+# Polling interval cap when the backend has no edge wait, in ms
+BUSY_POLL_MAX_MS = 20
+
 logger = logging.getLogger(__name__)
 
 class EPD:
@@ -45,6 +54,12 @@ class EPD:
         self.cs_pin = epdconfig.CS_PIN
         self.width = EPD_WIDTH
         self.height = EPD_HEIGHT
+        self.busy_timeout = BUSY_TIMEOUT
+        # (phase, seconds) for each busy wait since the last init()
+        self.busy_waits = []
+        # Bulk transfer totals since the last init()
+        self.spi_seconds = 0.0
+        self.spi_bytes = 0
 
     # Hardware reset
     def reset(self):
@@ -66,16 +81,50 @@ class EPD:
         epdconfig.digital_write(self.cs_pin, 0)
         epdconfig.spi_writebyte([data])
         epdconfig.digital_write(self.cs_pin, 1)
-        
-    def ReadBusy(self):
+
+    # Send a whole block of data with DC/CS asserted once, split into chunks
+    # that fit spidev's transfer buffer.
+    def send_data2(self, data):
+        start = time.monotonic()
+        epdconfig.digital_write(self.dc_pin, 1)
+        epdconfig.digital_write(self.cs_pin, 0)
+        for i in range(0, len(data), SPI_CHUNK_SIZE):
+            epdconfig.spi_writebyte2(data[i:i + SPI_CHUNK_SIZE])
+        epdconfig.digital_write(self.cs_pin, 1)
+        self.spi_seconds += time.monotonic() - start
+        self.spi_bytes += len(data)
+
+    def _poll_busy(self):
+        # Start with short sleeps and back off, so short phases are not
+        # rounded up to a long fixed interval
+        waited = 0
+        interval = 1
+        while(epdconfig.digital_read(self.busy_pin) == 0):      # 0: busy, 1: idle
+            if waited >= self.busy_timeout * 1000:
+                return False
+            epdconfig.delay_ms(interval)
+            waited += interval
+            interval = min(interval * 2, BUSY_POLL_MAX_MS)
+        return True
+
+    def ReadBusy(self, phase="busy"):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 0):      # 0: idle, 1: busy
-            epdconfig.delay_ms(100)
+        start = time.monotonic()
+        if hasattr(epdconfig, 'wait_for_level'):
+            released = epdconfig.wait_for_level(self.busy_pin, 1, self.busy_timeout)
+        else:
+            released = self._poll_busy()
+        self.busy_waits.append((phase, time.monotonic() - start))
+        if not released:
+            raise TimeoutError("e-Paper still busy after %d s (%s)" % (self.busy_timeout, phase))
         logger.debug("e-Paper busy release")
             
     def init(self):
         if (epdconfig.module_init() != 0):
             return -1
+        self.busy_waits = []
+        self.spi_seconds = 0.0
+        self.spi_bytes = 0
             
         self.reset()
 
@@ -119,81 +168,52 @@ class EPD:
         return 0
 
     def getbuffer(self, image):
-        # logger.debug("bufsiz = ",int(self.width/8) * self.height)
-        buf = [0xFF] * (int(self.width/8) * self.height)
+        # PIL packs mode '1' images as 1 bit per pixel, MSB first, white = 1,
+        # which is exactly the panel's layout, so no per-pixel loop is needed.
         image_monocolor = image.convert('1')
         imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
         logger.debug('imwidth = %d  imheight =  %d ',imwidth, imheight)
         if(imwidth == self.width and imheight == self.height):
             logger.debug("Horizontal")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if pixels[x, y] == 0:
-                        buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
+            return bytearray(image_monocolor.tobytes())
         elif(imwidth == self.height and imheight == self.width):
             logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        buf[int((newx + newy*self.width) / 8)] &= ~(0x80 >> (y % 8))
-        return buf
-
-    def display(self, imageblack, imagered):
-        self.send_command(0x10)
-        for i in range(0, int(self.width / 8 * self.height)):
-            temp1 = imageblack[i]
-            temp2 = imagered[i]
-            j = 0
-            while (j < 8):
-                if ((temp2 & 0x80) == 0x00):
-                    temp3 = 0x04                #red
-                elif ((temp1 & 0x80) == 0x00):
-                    temp3 = 0x00                #black
-                else:
-                    temp3 = 0x03                #white
-					
-                temp3 = (temp3 << 4) & 0xFF
-                temp1 = (temp1 << 1) & 0xFF
-                temp2 = (temp2 << 1) & 0xFF
-                j += 1
-                if((temp2 & 0x80) == 0x00):
-                    temp3 |= 0x04              #red
-                elif ((temp1 & 0x80) == 0x00):
-                    temp3 |= 0x00              #black
-                else:
-                    temp3 |= 0x03              #white
-                temp1 = (temp1 << 1) & 0xFF
-                temp2 = (temp2 << 1) & 0xFF
-                self.send_data(temp3)
-                j += 1
-                
+            image_monocolor = image_monocolor.transpose(Image.Transpose.ROTATE_90)
+            return bytearray(image_monocolor.tobytes())
+        return bytearray([0xFF]) * (int(self.width/8) * self.height)
+
+    def getpayload(self, imageblack, imagered):
+        # The panel takes 4 bits per pixel, two pixels per byte:
+        # 0x0 black, 0x3 white, 0x4 red, with red drawn over black.
+        size = (self.width, self.height)
+        black = Image.frombytes('1', size, bytes(imageblack))
+        red = Image.frombytes('1', size, bytes(imagered))
+        frame = Image.new('P', size, 0x03)
+        frame.paste(0x00, mask=ImageChops.invert(black))
+        frame.paste(0x04, mask=ImageChops.invert(red))
+        return frame.tobytes('raw', 'P;4')
+
+    def TurnOnDisplay(self):
         self.send_command(0x04) # POWER ON
-        self.ReadBusy()
+        self.ReadBusy("power on")
         self.send_command(0x12) # display refresh
         epdconfig.delay_ms(100)
-        self.ReadBusy()
-        
-    def Clear(self):
+        self.ReadBusy("refresh")
+
+    def display_payload(self, payload):
         self.send_command(0x10)
-        for i in range(0, int(self.width / 8 * self.height)):
-            self.send_data(0x33)
-            self.send_data(0x33)
-            self.send_data(0x33)
-            self.send_data(0x33)
-            
-        self.send_command(0x04) # POWER ON
-        self.ReadBusy()
-        self.send_command(0x12) # display refresh
-        epdconfig.delay_ms(100)
-        self.ReadBusy()
+        self.send_data2(payload)
+        self.TurnOnDisplay()
+
+    def display(self, imageblack, imagered):
+        self.display_payload(self.getpayload(imageblack, imagered))
+
+    def Clear(self):
+        self.display_payload(bytes([0x33]) * int(self.width / 2 * self.height))
 
     def sleep(self):
         self.send_command(0x02) # POWER_OFF
-        self.ReadBusy()
+        self.ReadBusy("power off")
         
         self.send_command(0x07) # DEEP_SLEEP
         self.send_data(0XA5)
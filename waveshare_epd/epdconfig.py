@@ -31,13 +31,26 @@ import os
 import logging
 import sys
 import time
-import subprocess
 
 from ctypes import *
 
 logger = logging.getLogger(__name__)
 
 
+def _wait_for_edge(GPIO, read, pin, value, timeout):
+    # RPi.GPIO-style wait_for_edge (Jetson.GPIO, Hobot.GPIO). The level is
+    # re-checked between short waits, so an edge that happens before the
+    # wait is armed is not missed.
+    edge = GPIO.RISING if value else GPIO.FALLING
+    deadline = time.monotonic() + timeout
+    while read(pin) != value:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        GPIO.wait_for_edge(pin, edge, timeout=max(1, int(min(remaining, 0.05) * 1000)))
+    return True
+
+
 class RaspberryPi:
     # Pin definition
     RST_PIN  = 17
@@ -98,6 +111,14 @@ class RaspberryPi:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_for_level(self, pin, value, timeout):
+        # gpiozero waits on the pin's edge event instead of polling
+        if pin != self.BUSY_PIN:
+            return self.digital_read(pin) == value
+        if value:
+            return bool(self.GPIO_BUSY_PIN.wait_for_press(timeout))
+        return bool(self.GPIO_BUSY_PIN.wait_for_release(timeout))
+
     def spi_writebyte(self, data):
         self.SPI.writebytes(data)
 
@@ -188,6 +209,8 @@ class JetsonNano:
                 break
         if self.SPI is None:
             raise RuntimeError('Cannot find sysfs_software_spi.so')
+        self.SPI.SYSFS_software_spi_transfer.argtypes = [ctypes.c_uint8]
+        self.SPI.SYSFS_software_spi_transfer.restype = None
 
         import Jetson.GPIO
         self.GPIO = Jetson.GPIO
@@ -201,12 +224,19 @@ class JetsonNano:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_for_level(self, pin, value, timeout):
+        return _wait_for_edge(self.GPIO, self.digital_read, pin, value, timeout)
+
     def spi_writebyte(self, data):
         self.SPI.SYSFS_software_spi_transfer(data[0])
 
     def spi_writebyte2(self, data):
-        for i in range(len(data)):
-            self.SPI.SYSFS_software_spi_transfer(data[i])
+        # sysfs_software_spi.so only exposes a per-byte transfer, so keep the
+        # loop tight: resolve the ctypes function once and skip result
+        # conversion instead of looking it up for every byte.
+        transfer = self.SPI.SYSFS_software_spi_transfer
+        for byte in bytes(data):
+            transfer(byte)
 
     def module_init(self):
         self.GPIO.setmode(self.GPIO.BCM)
@@ -259,6 +289,9 @@ class SunriseX3:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_for_level(self, pin, value, timeout):
+        return _wait_for_edge(self.GPIO, self.digital_read, pin, value, timeout)
+
     def spi_writebyte(self, data):
         self.SPI.writebytes(data)
 
@@ -301,22 +334,135 @@ class SunriseX3:
         self.GPIO.cleanup([self.RST_PIN, self.DC_PIN, self.CS_PIN, self.BUSY_PIN], self.PWR_PIN)
 
 
-if sys.version_info[0] == 2:
-    process = subprocess.Popen("cat /proc/cpuinfo | grep Raspberry", shell=True, stdout=subprocess.PIPE)
-else:
-    process = subprocess.Popen("cat /proc/cpuinfo | grep Raspberry", shell=True, stdout=subprocess.PIPE, text=True)
-output, _ = process.communicate()
-if sys.version_info[0] == 2:
-    output = output.decode(sys.stdout.encoding)
+class Recorder:
+    """In-process stand-in for the panel hardware.
+
+    Records every SPI byte, GPIO write and delay instead of touching
+    hardware, so the driver can run and be measured on any machine. Delays
+    only advance a simulated clock. After a POWER ON, refresh or POWER OFF
+    command, BUSY reads busy for busy_ms simulated milliseconds.
+    """
+    # Pin definition
+    RST_PIN  = 17
+    DC_PIN   = 25
+    CS_PIN   = 8
+    BUSY_PIN = 24
+    PWR_PIN  = 18
+
+    BUSY_COMMANDS = (0x02, 0x04, 0x12)
+
+    def __init__(self, busy_ms=0):
+        self.busy_ms = busy_ms
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.pins = {}
+        self.data = bytearray()     # every byte sent, commands and data
+        self.commands = []          # command bytes, in order
+        self.transfers = 0
+        self.toggles = {}           # pin -> number of level changes
+        self.clock_ms = 0.0
+        self.delay_total_ms = 0.0
+        self.busy_wait_ms = 0.0
+        self.busy_until_ms = 0.0
+
+    def stats(self):
+        return {
+            "bytes_sent": len(self.data),
+            "transfers": self.transfers,
+            "commands": len(self.commands),
+            "cs_toggles": self.toggles.get(self.CS_PIN, 0),
+            "dc_toggles": self.toggles.get(self.DC_PIN, 0),
+            "delay_ms": self.delay_total_ms,
+            "busy_wait_ms": self.busy_wait_ms,
+        }
 
-if "Raspberry" in output:
-    implementation = RaspberryPi()
-elif os.path.exists('/sys/bus/platform/drivers/gpio-x3'):
-    implementation = SunriseX3()
-else:
-    implementation = JetsonNano()
+    def digital_write(self, pin, value):
+        if self.pins.get(pin) != value:
+            self.toggles[pin] = self.toggles.get(pin, 0) + 1
+        self.pins[pin] = value
 
-for func in [x for x in dir(implementation) if not x.startswith('_')]:
-    setattr(sys.modules[__name__], func, getattr(implementation, func))
+    def digital_read(self, pin):
+        if pin == self.BUSY_PIN:
+            return 0 if self.clock_ms < self.busy_until_ms else 1  # 0: busy
+        return self.pins.get(pin, 0)
+
+    def delay_ms(self, delaytime):
+        if self.clock_ms < self.busy_until_ms:
+            self.busy_wait_ms += delaytime
+        self.clock_ms += delaytime
+        self.delay_total_ms += delaytime
+
+    def _transfer(self, data):
+        data = bytes(data)
+        self.transfers += 1
+        self.data += data
+        if self.pins.get(self.DC_PIN) == 0:
+            self.commands.extend(data)
+            if data[-1:] and data[-1] in self.BUSY_COMMANDS:
+                self.busy_until_ms = self.clock_ms + self.busy_ms
+
+    def spi_writebyte(self, data):
+        self._transfer(data)
+
+    def spi_writebyte2(self, data):
+        self._transfer(data)
+
+    def module_init(self, cleanup=False):
+        self.digital_write(self.PWR_PIN, 1)
+        return 0
+
+    def module_exit(self, cleanup=False):
+        logger.debug("recorder: %s", self.stats())
+        self.digital_write(self.RST_PIN, 0)
+        self.digital_write(self.DC_PIN, 0)
+        self.digital_write(self.PWR_PIN, 0)
+
+
+def use_implementation(impl):
+    """Route this module's functions to another backend, e.g. a Recorder."""
+    global implementation
+    module = sys.modules[__name__]
+    if 'implementation' in globals():
+        # Optional functions such as wait_for_level must not outlive
+        # the backend that provided them
+        for func in [x for x in dir(implementation) if not x.startswith('_')]:
+            if not hasattr(impl, func):
+                delattr(module, func)
+    implementation = impl
+    for func in [x for x in dir(impl) if not x.startswith('_')]:
+        setattr(module, func, getattr(impl, func))
+
+
+def _is_raspberry_pi():
+    # Read the board model in-process instead of spawning a shell
+    for path in ('/proc/device-tree/model', '/proc/cpuinfo'):
+        try:
+            with open(path, 'rb') as f:
+                if b'Raspberry' in f.read():
+                    return True
+        except OSError:
+            pass
+    return False
+
+
+def _detect_implementation():
+    # EPD_BACKEND=recorder runs the driver without hardware
+    if os.environ.get('EPD_BACKEND') == 'recorder':
+        return Recorder()
+    if _is_raspberry_pi():
+        return RaspberryPi()
+    if os.path.exists('/sys/bus/platform/drivers/gpio-x3'):
+        return SunriseX3()
+    return JetsonNano()
+
+
+def __getattr__(name):
+    # The backend is picked and set up on first use (e.g. EPD() reading
+    # the pin numbers), not when the module is imported
+    if name.startswith('_') or 'implementation' in globals():
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    use_implementation(_detect_implementation())
+    return getattr(sys.modules[__name__], name)
 
 ### END OF FILE ###